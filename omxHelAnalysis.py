@@ -1,887 +1,2863 @@
-#! /usr/bin/env python3
-
-# Purpose: This program analyses company data to find cheap stocks
-
-# Operating principle:
-# 1. Create dictionaries that include: companies, their ID:s for kauppalehti, their ticker numbers for Yahoo
-# 2. Create data frames of financial data necessary for company filtering
-# 3. Save all downloadable data to pickles and shelves to speedup runtime
-# 4. Create filters for each indicator
-# 5. Filter the companies and return list of companies that pass the filters
-# x. Create helpers to refine data frames and to weed out incorrect data
-
-
-import pandas as pd
-import numpy as np
-from xml.etree import ElementTree as ET
-import requests, bs4, re, urllib, os, pprint, shelve
-
-# ________________________________________________________
-### CONSTRUCT DATA FRAMES:
-
-def get_turnover_assets_data(company_id):
-    url = "http://www.kauppalehti.fi/5/i/porssi/porssikurssit/osake/tulostiedot.jsp?klid=" + company_id
-    df = pd.read_html(url)
-    df = df[6].iloc[[0, 1, 4]]
-    df = df.transpose()
-    df.rename(columns={0:"Year", 1:"Turnover", 4:"Adj. Net Current Assets"}, inplace=True)
-    df = df.iloc[1:]
-    df["Year"] = [2016,2015,2014,2013,2012]
-    df.set_index("Year", inplace=True)
-    df["Turnover"] = df["Turnover"].str.replace(u'\xa0', '')  # spaces are coded in unicode
-    df["Adj. Net Current Assets"] = df["Adj. Net Current Assets"].str.replace(u'\xa0', '')  # spaces are coded in unicode
-    df = df.apply(pd.to_numeric)   # May cause problems when downloading table values with "-", fix: manually deactivate
-    return df
-
-def get_pe_eps_data(company_id):
-    url = "http://www.kauppalehti.fi/5/i/porssi/porssikurssit/osake/tulostiedot.jsp?klid=" + company_id
-    df = pd.read_html(url)
-    df = df[10].iloc[[0, 5, 7, 9]]
-    df = df.transpose()
-    df.rename(columns={0: "Year", 5: "P/B", 7: "P/E", 9: "Earnings per Share"}, inplace=True)
-    df = df.iloc[1:]
-    df["Year"] = [2016,2015,2014,2013,2012]
-    df.set_index("Year", inplace=True)
-    df = df.apply(pd.to_numeric)   # May cause problems when downloading table values with "-", fix: manually deactivate
-    return df
-
-def get_dividend_data(company_id):
-    url = "http://www.kauppalehti.fi/5/i/porssi/osingot/osinkohistoria.jsp?klid=" + company_id
-    df = pd.read_html(url)
-    df = df[5]
-    df.rename(columns={0:"Year", 2:"Adj. Dividend"}, inplace=True)
-    df = df[["Year", "Adj. Dividend"]].iloc[1:]
-    df["Year"] = df["Year"].apply(pd.to_numeric)
-    df.set_index("Year", inplace=True)
-    df = df.apply(pd.to_numeric)    # May cause problems when downloading table values with "-", fix: manually deactivate
-    # Check for duplicated indexes (multiple dividens/year)
-    ar = df.index.duplicated()
-    if True in ar:
-        df = sum_dividends(df)  # method will also convert dividends to numeric
-    return df
-
-def get_current_ratio(company_id):
-    url = "http://www.kauppalehti.fi/5/i/porssi/porssikurssit/osake/tulostiedot.jsp?klid=" + company_id
-    df = pd.read_html(url)
-    df = df[9].iloc[[0, 1]]
-    df = df.transpose()
-    df.rename(columns={0: "Year", 1: "Current Ratio"}, inplace=True)
-    df = df.iloc[1:]
-    df["Year"] = [2016, 2015, 2014, 2013, 2012]
-    df.set_index("Year", inplace=True)
-    df = df.apply(pd.to_numeric)  # May cause problems when downloading table values with "-", fix: manually deactivate
-    return df
-
-def get_last_price(company_ticker):
-    url = "http://chartapi.finance.yahoo.com/instrument/1.0/" + company_ticker + ".HE/chartdata;type=quote;range=1m/csv"
-    source_code = urllib.request.urlopen(url).read().decode("latin-1")  # some company names have ääkköset which requires "latin-1" decoding instead of "utf-8"
-    stock_data = []
-    # splitting the data into lines
-    split_source = source_code.split("\n")
-    # unifying the data by removing general info at the top of the csv
-    for line in split_source:
-        split_line = line.split(",")
-        if len(split_line) == 6:  # include only lines with 6 values on it
-            if "values" not in line and "labels" not in line:  # exclude lines with str"Values" included on line
-                stock_data.append(line)
-    # take the data and sort it into respective variables
-    date, closep, highp, lowp, openp, volume = \
-        np.loadtxt(stock_data,
-                   delimiter=",",
-                   unpack=True)
-    return closep[len(stock_data)-1]    # latest stock closing price
-
-def combine_datasets(one, two, three, four):
-    df = one.join(two, how="outer")
-    df = df.join(three, how="outer")
-    df = df.join(four, how="outer")
-    return df
-
-def get_company_tickers():
-    url = "http://www.nasdaqomxnordic.com/shares/listed-companies/helsinki"
-    res = requests.get(url)
-    res.raise_for_status()
-    soup = bs4.BeautifulSoup(res.text, "lxml")
-    elem = soup.find_all("tr")    # is a resultsSet
-    # make a list of lists where each item has the cells of one line of the table
-    tableList = []  # list of lists that represents the table
-    headerList = [] # list of table headers
-    for tag in elem[0].find_all("th"):
-        headerList.append(tag.text)
-    tableList.append(headerList)
-    for line in elem:
-        set = line.find_all("td")
-        lineList = []   # list of values that represents one line in the table
-        for tag in set:
-            lineList.append(tag.text)
-        tableList.append(lineList)
-    df = pd.DataFrame(tableList)    # is the table as a dataframe w/o headers
-    df.rename(columns={0: "Name", 1: "Symbol", 2: "Currency", 3: "ISIN", 4: "Sector", 5:"ICB Code", 6: "Fact sheet"}, inplace=True)
-    df = df.iloc[2:]
-    df = df[["Name", "Symbol", "ISIN", "Sector", "ICB Code"]]
-    df = df.reset_index(drop=True)
-    return df
-
-def get_share_qty(company_id):  # uncompleted
-    url = "http://www.kauppalehti.fi/5/i/porssi/porssikurssit/osake/index.jsp?klid=" + company_id
-    res = requests.get(url)
-    res.raise_for_status()
-    soup = bs4.BeautifulSoup(res.text, "lxml")
-    #elem = soup.select("[class~=table_stock_basic_details]")
-    elem = soup.find_all("table")
-    #pprint.pprint(elem[18]) # Osakkeen perustiedot table
-    elem2 = str(elem[18])
-
-    table = ET.XML(elem2)
-    rows = iter(table)
-    headers = [col.text for col in next(rows)]
-    for row in rows:
-        values = [col.text for col in row]
-        print(dict(zip(headers, values)))
-    print(headers)
-    #pprint.pprint(elem[20]) # Kurssikehitys table 12kk muutos
-
-    #table = soup.find("table", attrs={"class":"table_stock_basic_details"})
-    #headings = [td.get_text() for td in table.find("td").find_all("td")]
-    #datasets = []
-    #for row in table.find_all("td")[1:]:
-    #    dataset = (headings, (td.get_text() for td in row.find_all("td")))
-    #    datasets.append(dataset)
-    #print(datasets)
-    #for dataset in datasets:
-    #    for field in dataset:
-    #        print("{0:<16}: {1}".format(field[0], field[1]))
-    #return datasets
-
-# ________________________________________________________
-### CREATING PICKLES:
-
-# Create company pickles from live data using existing company_dictionary
-def create_df_pickles(company_dictionary):
-    if not os.path.exists(".\\omxHelAnalysis"):
-        os.makedirs("omxHelAnalysis", exist_ok=True)
-    for compId in company_dictionary.values():
-        try:
-            df = combine_datasets(
-                get_turnover_assets_data(compId),
-                get_pe_eps_data(compId),
-                get_current_ratio(compId),
-                get_dividend_data(compId))
-            save_df_to_pickle(compId, df)
-            print("Data frame for companyID: " + str(compId) + ", saved to file: " + str(compId) + ".pickle")
-        except Exception as err:
-            print("An exception happened: " + str(err))
-
-def save_df_to_pickle(company_id, df):
-    if not os.path.exists(".\\omxHelAnalysis"):
-        os.makedirs("omxHelAnalysis", exist_ok=True)
-    pickleName = str(company_id) + ".pickle"
-    pickleLocation = ".\\omxHelAnalysis\\" + pickleName
-    df.to_pickle(pickleLocation)
-    return pickleName
-
-def load_company_data_pickle(company_id):
-    pickleName = str(company_id) + ".pickle"
-    pickleLocation = ".\\omxHelAnalysis\\" + pickleName
-    df = pd.read_pickle(pickleLocation)
-    return df
-
-# ________________________________________________________
-### GENERATING COMPANY DICTIONARIES:
-
-# Getting company IDs:
-def get_company_id_list():
-    company_id_list = []
-    url = "http://www.kauppalehti.fi/5/i/porssi/porssikurssit/"
-    res = requests.get(url)
-    res.raise_for_status()
-    soup = bs4.BeautifulSoup(res.text, "lxml")
-    linkList = soup.find_all("a")
-    endsWithNumber = re.compile(r'\d{4}$')
-    for link in linkList:
-        href = link.get("href")
-        href = str(href)
-        mo = endsWithNumber.search(href)
-        if mo != None:
-            if mo.group() not in company_id_list:
-                company_id_list.append(mo.group())
-
-    return company_id_list
-
-
-# Create dictionary with structure {compName : compTickers["Symbol"]
-def create_company_symbol_dictionary(compDict, compTickersDf):
-    beforeParenthesis = re.compile(r"""(
-                            (\w*)           # 1 First word
-                            (\s|-|'|&)*     # 2 separator
-                            (\w*)           # 3 Second word
-                            (\s|-|'|&)*     # 4 separator
-                            (\w*)           # 5 Third word
-                            (\s|-|'|&)*     # 6 separator
-                            (\w*)           # 7 Fourth word
-                            (\s\(\w+\))     # 8 symbol in parenthesis and the space before it
-                            )""", re.VERBOSE | re.IGNORECASE)
-#    pprint.pprint(compTickersDf)
-    dictionary = {}
-    companyNameList = []
-    missingTickers = {}
-    #print(compTickersDf)
-    for compName in compDict.keys():    # Creates a list of plain text company names from compDict
-        mo = beforeParenthesis.search(compName)
-        s = str(mo.group(0))
-        l = len(mo.group(9))
-        s = s[:-l]
-        companyNameList.append(s)
-    for i in companyNameList:   # Searches the CompTickers df for matches to the companyNamesList and returns the Symbol value
-        df = compTickersDf.loc[compTickers["Name"] == i]["Symbol"]
-        df = df.reset_index(drop=True)
-        df = np.array(df)
-        df = "".join(df)
-        if len(df) > 0:
-            dictionary[i] = df
-        if len(df) == 0:    # company name was not found in compTickers
-            missingTickers[i] = df
-    print("missing dictiotionary")
-    pprint.pprint(missingTickers.keys())
-    return dictionary
-
-# Create dictionary with structure {compDict.keys() : compTickers["Symbol"]
-def create_company_symbol_dictionary2(compDict, compTickersDf):
-    beforeParenthesis = re.compile(r"""(
-                            (\w*)           # 1 First word
-                            (\s|-|'|&)*     # 2 separator
-                            (\w*)           # 3 Second word
-                            (\s|-|'|&)*     # 4 separator
-                            (\w*)           # 5 Third word
-                            (\s|-|'|&)*     # 6 separator
-                            (\w*)           # 7 Fourth word
-                            (\s\(\w+\))     # 8 symbol in parenthesis and the space before it
-                            )""", re.VERBOSE | re.IGNORECASE)
-    dictionary = {}
-    companyNameDict = {}
-    missingTickers = {}
-    for compName in compDict.keys():    # Creates a list of plain text company names from compDict
-        mo = beforeParenthesis.search(compName)
-        s = str(mo.group(0))
-        l = len(mo.group(9))
-        s = s[:-l]
-        companyNameDict[compName] = s
-    for i in companyNameDict.keys():   # Searches the CompTickers df for matches to the companyNamesList and returns the Symbol value
-        df = compTickersDf.loc[compTickers["Name"] == companyNameDict[i]]["Symbol"]
-        df = df.reset_index(drop=True)
-        df = np.array(df)
-        df = "".join(df)
-        if len(df) > 0:
-            dictionary[i] = df  # matches compDict.key()
-        if len(df) == 0:    # company name was not found in compTickers
-            missingTickers[i] = df
-    return dictionary
-
-# Getting company name:
-def get_company_name(company_id):
-    url = "http://www.kauppalehti.fi/5/i/porssi/porssikurssit/osake/tulostiedot.jsp?klid=" + company_id
-    res = requests.get(url)
-    res.raise_for_status()
-    soup = bs4.BeautifulSoup(res.text, "lxml")
-    return soup.find_all("h1")[1].get_text()
-
-# Create a dictionary in the format {companyName:CompanyId}
-def company_dictionary():
-    dictionary = {}
-    for compId in get_company_id_list():
-        dictionary[get_company_name(compId)] = compId
-    return dictionary
-
-# Create a dictionary of company dataframes {companyName:df_pickle_Name}
-def dataFrame_dictionary(compDictionary):
-    dictionary = {}
-    for compName in list(compDictionary.keys()):
-        dictionary[compName] = combine_datasets(
-            get_turnover_assets_data(compDictionary[compName]),
-            get_pe_eps_data(compDictionary[compName]),
-            get_dividend_data(compDictionary[compName]))
-    return dictionary
-
-def get_price_dictionary(compTickersDict):
-    dictionary = {}
-    for stock in compTickersDict.keys():
-        try:
-            dictionary[stock] = float(get_last_price(compTickersDict[stock]))
-        except:
-            print("Could not get price for: " + str(stock))
-            dictionary[stock] = np.nan
-    return dictionary
-
-# ________________________________________________________
-### ERROR CHECKING:
-def list_missing_df(compDictionary):
-    missingIds = []
-    for compName in compDictionary.keys():
-        company_id = compDictionary[compName]
-        pickleName = str(company_id) + ".pickle"
-        pickleLocation = ".\\omxHelAnalysis\\" + pickleName
-        if not os.path.exists(pickleLocation):
-            missingIds.append(company_id)
-            print("Missing data for company: " + compName + ", id: " + company_id)
-    return missingIds
-
-def create_df_pickles_from_Idlist(listOfIds):
-    for compId in listOfIds:
-        try:
-            df = combine_datasets(
-                get_turnover_assets_data(compId),
-                get_pe_eps_data(compId),
-                get_current_ratio(compId),
-                get_dividend_data(compId))
-            save_df_to_pickle(compId, df)
-            print("Data frame for companyID: " + str(compId) + ", saved to file: " + str(compId) + ".pickle")
-        except Exception as err:
-            print("An exception happened: " + str(err))
-
-# Create errorList by checking each df for errors
-def create_errorList(ListOfIds):
-    errorsList = []
-    for compId in ListOfIds:
-        df = load_company_data_pickle(compId)
-        for col in list(df.columns.values):
-            try:
-                df[col] = df[col].apply(pd.to_numeric)
-            except Exception as err:
-                print("An exception happened: " + str(err))
-                errorsList.append(compId)
-    errorsList = list(set(errorsList))  # Removes duplicated values from the list
-    return errorsList
-
-def create_errorList2(ListOfIds):
-    errorsList = []
-    for compId in ListOfIds:
-        if not check_df_for_float64(compId):
-            errorsList.append(compId)
-    errorsList = list(set(errorsList))  # Removes duplicated values from the list
-    return errorsList
-
-# Check df if all columns have dtype=float64
-def check_df_for_float64(compId):
-    df = load_company_data_pickle(compId)
-    res = True
-    for col in list(df.columns.values):
-        if check_column_dtype(df, col) != np.dtype("float64"):
-            res = False
-    return res
-
-# Check data type for column
-def check_column_dtype(df, column):
-    return np.array(df[column]).dtype
-
-# Check if df is missing some columns
-def check_for_missing_columns(df):
-    columnNames = ["Turnover", "Adj. Net Current Assets", "P/E", "P/B", "Earnings per Share", "Adj. Dividend"]
-    count = 0
-    if len(list(df.columns.values)) < len(columnNames):
-        count += 1
-    else:
-        for col in list(df.columns.values):
-            if col not in columnNames:
-                count += 1
-    if count > 1:
-        return True
-    else:
-        return False
-
-# Check if df is missing some columns
-def check_for_missing_columns2(df):
-    columnNames = ["Turnover", "Adj. Net Current Assets", "P/E", "P/B", "Earnings per Share", "Adj. Dividend"]
-    count = 0
-    for col in columnNames:
-        if col not in list(df.columns.values):
-            count += 1
-    if count > 0:
-        return True
-    else:
-        return False
-
-# ________________________________________________________
-### ERROR HANDLING:
-
-# Changing df to numeric and removing unicode character \xa0
-def convert_pickled_df_to_numeric(compId):
-    df = load_company_data_pickle(compId)
-    for col in list(df.columns.values):
-        try:
-            df[col] = df[col].str.replace(u'\xa0', '')  # spaces are coded in unicode
-            df[col] = df[col].apply(pd.to_numeric)  # converts values to numeric
-        except Exception as err:
-            print("An exception occurred: " + str(err))
-            if compId != None:
-                print(compId)
-    return df
-
-# Changing values in dfs
-def convert_column_error_to_NaN(compId, column):
-    df = load_company_data_pickle(compId)
-    df[column] = pd.to_numeric(df[column], errors="coerce")
-    return df
-
-def convert_column_unicode_thousand(compId, column):
-    df = load_company_data_pickle(compId)
-    df[column] = df[column].str.replace(u'\xa0', '')  # spaces are coded in unicode
-    df[column] = pd.to_numeric(df[column])
-    return df
-
-# Changing all values in dfs to numeric with coerce
-def convert_error_to_NaN_coerce(compId):
-    df = load_company_data_pickle(compId)
-    for col in list(df.columns.values):
-        df[col] = pd.to_numeric(df[col], errors="coerce")
-    return df
-
-# Replacing "-" with NaN-values
-def convert_line_to_empty(compId):
-    df = load_company_data_pickle(compId)
-    for col in list(df.columns.values):
-        try:
-            df[col] = df[col].str.replace('-', "")
-        except Exception as err:
-            print("An exception occurred: " + str(err))
-            if compId != None:
-                print(compId)
-    return df
-
-# In case of multiple dividends sum them up to one index value (year)
-def sum_dividends(df):
-    df = df.apply(pd.to_numeric)  # converts values to numeric
-    df = df.groupby(df.index).sum() # sum all values together that have same index value
-    return df
-
-# Rename keys in a dictionary
-def rename_dict_keys(dictionary):
-    for key in dictionary.keys():
-        print(key)
-        rename = input("Do you want to rename key? (input_new_key/n)")
-        if rename != "n":
-            dictionary[rename] = dictionary.pop[key]
-    return dictionary
-
-# update values in a df column
-def change_column_values(df, column):
-    i = 0
-    while i < len(df):
-        a = df.iloc[i][column]
-        print(a)
-        b = input("rename: (empty/input)")  # will take any non empty string as the new value for the df cell
-        if b != "":
-            df.set_value(i, column, b)
-            print(df.iloc[i][column])
-        i += 1
-    return df
-
-
-# ________________________________________________________
-### FINANCIAL FILTERS:
-
-# 1. Adequate Size of the Enterprise
-def filter_adequate_size(df):
-    df.sort_index(ascending=False, inplace=True)
-    turnoverLimit = 100 # 100 million €
-    if df.iloc[1]["Turnover"] > turnoverLimit:
-        return True
-    else:
-        return False
-
-def p_filter_adequate_size(df):
-    df.sort_index(ascending=False, inplace=True)
-    turnover = df.iloc[1]["Turnover"]
-    return turnover
-
-# 2. Sufficiently Strong Financial Condition
-
-
-# 3. Earning Stability
-def filter_earning_stability(df):
-    df.sort_index(ascending=False, inplace=True)
-    df = df["Earnings per Share"]
-    df.dropna(how="any", inplace=True)
-    df.sort_index(ascending=False, inplace=True)
-    epsLimit = 0    # some earnings each year
-    span = min(len(df.index), 10)   # for 10 year or if not enough data than max of data
-    df = df.iloc[:span]
-    i = 0
-    for val in df:
-        if val <= epsLimit:
-            i += 1
-    if i > 0:
-        return False
-    else:
-        return True
-
-def p_filter_earning_stability(df):
-    df.sort_index(ascending=False, inplace=True)
-    df = df["Earnings per Share"]
-    df.dropna(how="any", inplace=True)
-    df.sort_index(ascending=False, inplace=True)
-    years = min(len(df.index), 10)  # for 10 year or if not enough data than max of data
-    df = df.iloc[:years]
-    low = 99999
-    for val in df:
-        low = min(low, val)
-    return years, low
-
-# 4. Dividend Record
-def filter_dividend_record(df):
-    df.sort_index(ascending=False, inplace=True)
-    divHist = 0  # some dividends payed uninterrupted for past 20 years
-    span = min(len(df.index), 20)   # for 20 years or if not enough data then max of data
-    df = df["Adj. Dividend"].iloc[:span]
-    df.dropna(how="any", inplace=True)
-    i = 0
-    for val in df:
-        if val == divHist:
-            i += 1
-    if i > 0:
-        return False
-    else:
-        return True
-
-def p_filter_dividend_record(df):
-    df.sort_index(ascending=False, inplace=True)
-    years = min(len(df.index), 20)  # for 20 years or if not enough data then max of data
-    df = df["Adj. Dividend"].iloc[:years]
-    df.dropna(how="any", inplace=True)
-    low = 99999
-    for val in df:
-        low = min(low, val)
-    return years, low
-
-# 5. Earnings Growth
-def filter_earnings_growth(df):
-    df.sort_index(ascending=False, inplace=True)
-    eGrowth = 1/3  # earnings growth by 1/3 in last 10 years
-    df = df["Earnings per Share"]
-    df.dropna(how="any", inplace=True)
-    span = min(len(df.index), 10)   # for 10 years or if not enough data then max of data
-    if span > 6:
-        dfLately = df.iloc[:3].sum() /3
-        dfEarly = df.iloc[len(df.index)-3:].sum() /3
-        if dfEarly > 0:
-            eg = dfLately / dfEarly - 1
-        else:
-            eg = -1
-    elif 4 < span < 6:
-        dfLately = df.iloc[:2].sum() /2
-        dfEarly = df.iloc[3:5].sum() /2
-        if dfEarly > 0:
-            eg = dfLately/dfEarly-1
-        else:
-            eg = -1
-    else:
-        eg = -1
-    if eg >= eGrowth:
-        if dfEarly >= 0 and dfLately >= 0:
-            return True
-        else:
-            return False
-    else:
-        return False
-
-def p_filter_earnings_growth(df):
-    df.sort_index(ascending=False, inplace=True)
-    df = df["Earnings per Share"]
-    df.dropna(how="any", inplace=True)
-    years = min(len(df.index), 10)  # for 10 years or if not enough data then max of data
-    if years > 6:
-        dfLately = df.iloc[:3].sum() / 3
-        dfEarly = df.iloc[len(df.index) - 3:].sum() / 3
-        if dfEarly > 0:
-            growth = dfLately / dfEarly - 1
-        else:
-            growth = -1
-    elif 4 < years < 6:
-        dfLately = df.iloc[:2].sum() / 2
-        dfEarly = df.iloc[3:5].sum() / 2
-        if dfEarly > 0:
-            growth = dfLately / dfEarly - 1
-        else:
-            growth = -1
-    else:
-        growth = -1
-    return years, growth
-
-# 6. Moderate Price/Earnings Ratio
-def filter_moderate_PE_ratio(df, price):
-    df.sort_index(ascending=False, inplace=True)
-    df = df["Earnings per Share"]
-    df.dropna(how="any", inplace=True)
-    years = 3
-    PElimit = 15
-    i = 0
-    s = 0
-    while i < years:
-        s += df.iloc[i]
-        i += 1
-    average = s / years
-    if average == 0:
-        pe = 0
-    else:
-        pe = price / average
-    if 0 < pe < PElimit:
-        return True
-    else:
-        return False
-
-def p_filter_moderate_PE_ratio(df, price):
-    df.sort_index(ascending=False, inplace=True)
-    df = df["Earnings per Share"]
-    df.dropna(how="any", inplace=True)
-    years = 3
-    i = 0
-    s = 0
-    while i < years:
-        s += df.iloc[i]
-        i += 1
-    average = s / years
-    if average == 0:
-        pe = 0
-    else:
-        pe = price / average
-    return years, pe
-
-# 7. Moderate Ratio of Price to Assets
-def filter_moderate_Price_to_Assets_ratio(df):
-    df.sort_index(ascending=False, inplace=True)
-    df.dropna(how="any", inplace=True)
-    df = df[["P/B", "P/E"]]
-    PBlimit = 1.5
-    PExPBlimit = 22.5
-    if len(df) < 1:
-        return False
-    elif df["P/B"].iloc[0] > PBlimit:
-        return False
-    elif df["P/E"].iloc[0] * df["P/B"].iloc[0] > PExPBlimit:
-        return False
-    else:
-        return True
-
-def p_filter_moderate_Price_to_Assets_ratio(df):
-    df.sort_index(ascending=False, inplace=True)
-    df.dropna(how="any", inplace=True)
-    df = df[["P/B", "P/E"]]
-    PB = df["P/B"].iloc[0]
-    PExPB = df["P/E"].iloc[0] * df["P/B"].iloc[0]
-    return PB, PExPB
-
-# ________________________________________________________
-### START OF RUNTIME:
-
-# Loading company dictionary from a shelve file into variable compDict
-shelfFile = shelve.open("omxHelVariable")
-compDict = shelfFile["dict"]
-errorsList = shelfFile["errorsList"]
-compTickers = shelfFile["compTickers"]
-priceDict = shelfFile["priceDict"]
-compTickersDict = shelfFile["compTickersDict"]
-
-#pprint.pprint(compDict)
-
-#currentID = "1901"
-#create_df_pickles_from_Idlist([currentID])
-#print(load_company_data_pickle(currentID))
-#print(get_pe_eps_data(currentID))
-#print(filter_moderate_Price_to_Assets_ratio(load_company_data_pickle(currentID)))
-
-
-
-#Filtered results:
-fAdequateSize = []      # List of companies passing Adequate Size
-fEarningsStability = [] # List of companies passing Earnings Stability
-fDividendRecord = []    # List of companies passing Dividend Record
-fModeratePEratio = []   # List of companies passing Moderate PE Rate
-fEarningsGrowth = []    # List of companies passing Earning Growth
-fModeratePtoAratio = [] # List of companies passing Moderate Price to Assets Ratio
-fCombined = []          # List of companies passing All Filters
-
-
-# FILTERING::::::::::::::::::::::::::::::::::
-# Exclude missing dfs from compDict
-missingDfList = list_missing_df(compDict)
-missingDfList.append(compDict["Endomines AB (ENDO)"])
-missingDfList.append(compDict["Aktia Pankki Oyj (AKT)"])
-missingDfList.append(compDict["SSAB (SSAB)"])
-missingDfList.append(compDict["Qt Group (QTCOM)"])
-workingIdList = []
-for compId in compDict.values():
-    if compId not in missingDfList:
-        workingIdList.append(compId)
-
-pprint.pprint(workingIdList)
-print(len(workingIdList))
-
-# PROTOCAL: Update data from website
-if input("Update all df:s from Kauppalehti? (y/n)") == "y":
-    create_df_pickles(compDict)
-
-# Check for errors::::::::::::::::::::::::::::
-if input("Refresh errorsList? (y/n)") == "y":
-    IdList = compDict.values()
-    # Refresh the missingDfList
-    missingDfList = list_missing_df(compDict)
-    print("MissingDfList:")
-    pprint.pprint(missingDfList)
-    # Refresh errorsList (effectively checks if df is convertible to numeric or not)
-    checkList = []
-    for compId in IdList:
-        if compId not in missingDfList:
-            checkList.append(compId)
-    errorsList = create_errorList2(checkList)
-    shelfFile["errorsList"] = errorsList
-    print("ErrorsList:")
-    print(errorsList)
-
-if input("Create a list of df:s that are missing columns? (y/n)") == "y":
-    dfsWithMissingColumns = []
-    for comp in workingIdList:
-        if check_for_missing_columns2(load_company_data_pickle(comp)):
-            dfsWithMissingColumns.append(comp)
-    print("These df:s are missing some columns:")
-    pprint.pprint(dfsWithMissingColumns)
-
-    if input("Update df:s for these companies from Kauppalehti? (y/n)") == "y":
-        create_df_pickles_from_Idlist(dfsWithMissingColumns)
-
-if input("Set errorList to all except those which do not have df:s? (y/n)") == "y":
-    IdList = compDict.values()
-    # Refresh the missingDfList
-    missingDfList = list_missing_df(compDict)
-    print("MissingDfList:")
-    pprint.pprint(missingDfList)
-    # Refresh errorsList (effectively checks if df is convertible to numeric or not)
-    checkList = []
-    for compId in IdList:
-        if compId not in missingDfList:
-            checkList.append(compId)
-    errorsList = checkList
-    shelfFile["errorsList"] = errorsList
-    print("ErrorsList:")
-    print(errorsList)
-
-# Check and repair df:s on the errors list
-if input("Enter error checking for items on errorsList? (y/n)") == "y":
-    for currentId in errorsList:
-        print(get_company_name(currentId))
-        print(currentId)
-        print(load_company_data_pickle(currentId))
-
-        if input("Do you want reload df from website? (y/n)") == "y":
-            # Reload df from website
-            create_df_pickles_from_Idlist([currentId])
-            print(load_company_data_pickle(currentId))
-
-        if input("Do you want to convert columns to num with coerce? (y/n)") == "y":
-            # Convert one column to num with coerce
-            df = convert_error_to_NaN_coerce(currentId)
-            print(df)
-            save_df_to_pickle(currentId, df)
-
-        if input("Do you want to convert - to empty? (y/n)") == "y":
-            # Convert "-" to ""
-            save_df_to_pickle(currentId, convert_line_to_empty(currentId))
-            print(load_company_data_pickle(currentId))
-
-        if input("Do you want convert pickles to numeric and fix unicode? (y/n)") == "y":
-            # convert pickles to numeric and fix unicode
-            df = convert_pickled_df_to_numeric(currentId)
-            print(df)
-            save_df_to_pickle(currentId, df)
-
-
-# PROTOCAL: Do the stock screening
-
-if input("Enter stock screening? (y/n)") == "y":
-    print(":::::::::::::::::::::::::::::::::::::::::")
-    print("Filter adequate size: ")
-    for comp in compDict.keys():
-        compId = compDict[comp]
-        if compId in workingIdList:
-            if filter_adequate_size(load_company_data_pickle(compId)):
-                fAdequateSize.append(comp)
-
-    print(":::::::::::::::::::::::::::::::::::::::::")
-    print("Filter earnings stability: ")
-    for comp in compDict.keys():
-        compId = compDict[comp]
-        if compId in workingIdList:
-            if filter_earning_stability(load_company_data_pickle(compId)):
-                fEarningsStability.append(comp)
-
-    print(":::::::::::::::::::::::::::::::::::::::::")
-    print("Dividend record: ")
-    for comp in compDict.keys():
-        compId = compDict[comp]
-        if compId in workingIdList:
-            if filter_dividend_record(load_company_data_pickle(compId)):
-                fDividendRecord.append(comp)
-
-
-    print(":::::::::::::::::::::::::::::::::::::::::")
-    print("Moderate P/E ratio: ")
-    for comp in compDict.keys():
-        compId = compDict[comp]
-        if compId in workingIdList:
-            try:
-                if filter_moderate_PE_ratio(load_company_data_pickle(compId), priceDict[comp]):
-                    fModeratePEratio.append(comp)
-            except:
-                print("Error with: " + str(comp))
-
-
-    print(":::::::::::::::::::::::::::::::::::::::::")
-    print("Earnings Growth: ")
-    for comp in compDict.keys():
-        compId = compDict[comp]
-        if compId in workingIdList:
-            if filter_earnings_growth(load_company_data_pickle(compId)):
-                fEarningsGrowth.append(comp)
-
-
-    print(":::::::::::::::::::::::::::::::::::::::::")
-    print("Moderate ratio of Price to Assests ratio: ")
-    for comp in compDict.keys():
-        compId = compDict[comp]
-        if compId in workingIdList:
-            if filter_moderate_Price_to_Assets_ratio(load_company_data_pickle(compId)):
-                fModeratePtoAratio.append(comp)
-
-
-    print(":::::::::::::::::::::::::::::::::::::::::")
-    print("All Filters Combined: ")
-    for comp in fAdequateSize:
-        if comp in fEarningsGrowth:
-            if comp in fDividendRecord:
-                if comp in fModeratePEratio:
-                    if comp in fEarningsGrowth:
-                        if comp in fModeratePtoAratio:
-                            fCombined.append(comp)
-
-    print("Adequate size qty: " + str(len(fAdequateSize)))
-    print("Earnings stability qty: " + str(len(fEarningsStability)))
-    print("Dividend record qty: " + str(len(fDividendRecord)))
-    print("Moderate PE ratio qty: " + str(len(fModeratePEratio)))
-    print("Earnings growth qty: " + str(len(fEarningsGrowth)))
-    print("Moderate Price to Assets ratio qty: " + str(len(fModeratePtoAratio)))
-    print("All filters combined qty: " + str(len(fCombined)))
-    pprint.pprint(fCombined)
-
-    # Print the data frames for the companies that pass all filters
-    for comp in fCombined:
-        print(comp)
-        print(load_company_data_pickle(compDict[comp]))
-        print("Company size:")
-        print(p_filter_adequate_size(load_company_data_pickle(compDict[comp])))
-        print("Earning stability: (years (10) / lowest value)")
-        print(p_filter_earning_stability(load_company_data_pickle(compDict[comp])))
-        print("Dividend record: (years (20) / lowest value)")
-        print(p_filter_dividend_record(load_company_data_pickle(compDict[comp])))
-        print("Earnings growth: (years (10) / growth (0.33))")
-        print(p_filter_earnings_growth(load_company_data_pickle(compDict[comp])))
-
-
-shelfFile.close()
\ No newline at end of file
+#! /usr/bin/env python3
+
+# Purpose: This program analyses company data to find cheap stocks
+
+# Operating principle:
+# 1. Create dictionaries that include: companies, their ID:s for kauppalehti, their ticker numbers for Yahoo
+# 2. Create data frames of financial data necessary for company filtering
+# 3. Save all downloadable data to pickles and shelves to speedup runtime
+# 4. Create filters for each indicator
+# 5. Filter the companies and return list of companies that pass the filters
+# x. Create helpers to refine data frames and to weed out incorrect data
+
+
+import importlib, types
+import re, urllib.request, urllib.parse, os, sys, io, json, time, threading, queue, collections, hashlib, atexit, pprint, shelve
+import argparse, contextlib, glob, difflib, unicodedata
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+# Heavy modules are imported on first use, so importing this file and reaching the first prompt stay fast
+class LazyModule(types.ModuleType):
+    def __init__(self, name, submodules=()):
+        super().__init__(name)
+        self.__dict__["_submodules"] = submodules
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        for submodule in self._submodules:
+            importlib.import_module(self.__name__ + "." + submodule)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+pd = LazyModule("pandas")
+np = LazyModule("numpy")
+lxml = LazyModule("lxml", ["html"])
+requests = LazyModule("requests")
+
+# ________________________________________________________
+### HTTP CACHE:
+
+# Seconds a cached response is used without asking the server, the first matching part of the url decides
+cacheTtls = [
+    ("tulostiedot.jsp", 3 * 24 * 3600),     # financials: days
+    ("osinkohistoria.jsp", 3 * 24 * 3600),  # dividends: days
+    ("osake/index.jsp", 24 * 3600),         # stock basic details
+    ("finance.yahoo.com", 10 * 60),         # prices: minutes
+    ("nasdaqomxnordic.com", 7 * 24 * 3600), # listings: a week
+    ("porssi/porssikurssit/", 7 * 24 * 3600),
+]
+
+# Charset of a page: from the Content-Type header, or else from the <meta> charset of the page, None when neither has one
+# (requests gives ISO-8859-1 to text/html without a charset, which garbles utf-8 pages such as "1\xa0234")
+contentCharset = re.compile(r"charset=[\"']?([\w-]+)", re.I)
+metaCharset = re.compile(rb"<meta[^>]+charset=[\"']?([\w-]+)", re.I)
+
+def page_encoding(contentType, content):
+    match = contentCharset.search(contentType or "")
+    if match:
+        return match.group(1)
+    match = metaCharset.search(content[:4096])
+    if match:
+        return match.group(1).decode("ascii")
+    return None
+
+# On-disk cache of responses keyed by url
+# Stale entries are revalidated with If-None-Match / If-Modified-Since, the least recently used are evicted over max_bytes
+class HttpCache:
+    def __init__(self, location=".\\omxHelAnalysis\\httpCache", max_bytes=200 * 1024 * 1024, ttls=cacheTtls):
+        self.location = location
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        self.lock = threading.RLock()
+        self.index = None   # shelve {url: {"file", "etag", "lastModified", "contentType", "encoding", "fetched", "used", "size"}}
+        self.usage = None   # {url: size}, least recently used first, kept in memory so that evicting does not read the index
+        self.total = 0      # bytes of all cached responses
+        self.statistics = {"hits": 0, "revalidated": 0, "misses": 0, "bytes saved": 0, "evictions": 0}
+
+    def open(self):
+        if self.index is None:
+            os.makedirs(self.location, exist_ok=True)
+            self.index = shelve.open(os.path.join(self.location, "index"))
+            entries = sorted((entry["used"], url, entry["size"]) for url, entry in self.index.items())
+            self.usage = collections.OrderedDict((url, size) for used, url, size in entries)
+            self.total = sum(self.usage.values())
+            atexit.register(self.close)
+
+    def close(self):
+        with self.lock:
+            if self.index is not None:
+                self.index.close()
+                self.index = None
+
+    def ttl(self, url):
+        for part, seconds in self.ttls:
+            if part in url:
+                return seconds
+        return 0
+
+    def read_body(self, entry):
+        with open(os.path.join(self.location, entry["file"]), "rb") as f:
+            return f.read()
+
+    # Entries saved before the content type was kept only have the encoding that requests guessed
+    def encoding(self, entry, content):
+        return page_encoding(entry.get("contentType"), content) or entry["encoding"]
+
+    # Return (content, encoding) for url, downloading with download(url, headers) only when needed
+    # max_age replaces the ttl of the url, 0 revalidates every time
+    def fetch(self, url, download, max_age=None):
+        if max_age is None:
+            max_age = self.ttl(url)
+        with self.lock:
+            self.open()
+            entry = self.index.get(url)
+        if entry is not None and time.time() - entry["fetched"] < max_age:
+            try:
+                content = self.read_body(entry)
+                with self.lock:
+                    self.statistics["hits"] += 1
+                    self.statistics["bytes saved"] += len(content)
+                    self.touch(url, entry)
+                return content, self.encoding(entry, content)
+            except OSError:
+                entry = None
+        headers = {}
+        if entry is not None and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry["lastModified"]:
+            headers["If-Modified-Since"] = entry["lastModified"]
+        res = download(url, headers)
+        if res.status_code == 304 and entry is not None:
+            try:
+                content = self.read_body(entry)
+                with self.lock:
+                    self.statistics["revalidated"] += 1
+                    self.statistics["bytes saved"] += len(content)
+                    entry["fetched"] = time.time()
+                    self.touch(url, entry)
+                return content, self.encoding(entry, content)
+            except OSError:     # evicted by another thread meanwhile, download it again without the conditional headers
+                res = download(url, {})
+        res.raise_for_status()
+        contentType = res.headers.get("Content-Type")
+        encoding = page_encoding(contentType, res.content) or res.apparent_encoding
+        self.store(url, res.content, res.headers.get("ETag"), res.headers.get("Last-Modified"), contentType, encoding)
+        with self.lock:
+            self.statistics["misses"] += 1
+        return res.content, encoding
+
+    # Mark a cached response as used now, unless it was evicted meanwhile
+    def touch(self, url, entry):
+        if url in self.usage:
+            entry["used"] = time.time()
+            self.index[url] = entry
+            self.usage.move_to_end(url)
+
+    def store(self, url, content, etag, lastModified, contentType, encoding):
+        fileName = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        # the body is written outside the lock so that the other downloads are not held up, os.replace makes it appear whole
+        temporary = os.path.join(self.location, fileName + "." + str(threading.get_ident()))
+        with open(temporary, "wb") as f:
+            f.write(content)
+        with self.lock:
+            os.replace(temporary, os.path.join(self.location, fileName))
+            self.index[url] = {"file": fileName, "etag": etag, "lastModified": lastModified, "contentType": contentType, "encoding": encoding,
+                               "fetched": time.time(), "used": time.time(), "size": len(content)}
+            self.total += len(content) - self.usage.pop(url, 0)
+            self.usage[url] = len(content)
+            self.evict()
+
+    # Remove the least recently used responses until the cache fits in max_bytes
+    def evict(self):
+        while self.total > self.max_bytes and self.usage:
+            url, size = self.usage.popitem(last=False)
+            entry = self.index.pop(url, None)
+            if entry is not None:
+                try:
+                    os.remove(os.path.join(self.location, entry["file"]))
+                except OSError:
+                    pass
+            self.total -= size
+            self.statistics["evictions"] += 1
+
+    def stats(self):
+        with self.lock:
+            self.open()
+            statistics = dict(self.statistics)
+            statistics["entries"] = len(self.usage)
+            statistics["bytes"] = self.total
+        return statistics
+
+# ________________________________________________________
+### FETCHING PAGES:
+
+resultsUrl = "http://www.kauppalehti.fi/5/i/porssi/porssikurssit/osake/tulostiedot.jsp?klid="
+dividendsUrl = "http://www.kauppalehti.fi/5/i/porssi/osingot/osinkohistoria.jsp?klid="
+
+# Spaces out requests to the same host so that concurrent refreshes stay polite
+# Each caller can give its own rate, so overlapping refreshes do not change each other's rate
+class HostRateLimiter:
+    def __init__(self, per_host_rate=None):
+        self.per_host_rate = per_host_rate  # default requests per second per host, None means unlimited
+        self.lock = threading.Lock()
+        self.nextSlot = {}  # {host: earliest time for the next request}
+
+    def wait(self, url, per_host_rate=None):
+        if per_host_rate is None:
+            per_host_rate = self.per_host_rate
+        if not per_host_rate:
+            return
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.nextSlot.get(host, now))
+            self.nextSlot[host] = slot + 1 / per_host_rate
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+rateLimiter = HostRateLimiter()
+
+# One pooled http session for all downloads: keep-alive connections per host, timeouts, gzip
+# and at most max_per_host requests in flight to the same host
+class HttpClient:
+    def __init__(self, max_per_host=8, timeout=(5, 30), max_hosts=20):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.max_hosts = max_hosts
+        self.session = None     # created on the first request
+        self.adapter = None
+        self.lock = threading.Lock()
+        self.hostSlots = {}     # {host: semaphore}
+        self.requests = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=10000)
+
+    def host_slot(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.hostSlots:
+                self.hostSlots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.hostSlots[host]
+
+    def open(self):
+        with self.lock:
+            if self.session is None:
+                self.adapter = requests.adapters.HTTPAdapter(pool_connections=self.max_hosts, pool_maxsize=self.max_per_host)
+                session = requests.Session()
+                session.headers["Accept-Encoding"] = "gzip, deflate"
+                session.mount("http://", self.adapter)
+                session.mount("https://", self.adapter)
+                self.session = session
+        return self.session
+
+    # per_host_rate replaces the rate of rateLimiter for this request
+    def get(self, url, headers=None, per_host_rate=None):
+        self.open()
+        with self.host_slot(url):
+            rateLimiter.wait(url, per_host_rate)
+            start = time.perf_counter()
+            try:
+                res = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException:
+                with self.lock:
+                    self.errors += 1
+                raise
+            with self.lock:
+                self.requests += 1
+                self.latencies.append(time.perf_counter() - start)
+        return res
+
+    # Connections opened by the pools so far, every other request reused a kept-alive connection
+    def connections(self):
+        if self.adapter is None:
+            return 0
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in list(pools.keys()))
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies)
+            statistics = {"requests": self.requests, "errors": self.errors}
+        newConnections = self.connections()
+        statistics["new connections"] = newConnections
+        statistics["reused connections"] = max(statistics["requests"] - newConnections, 0)
+        for percentile in [50, 90, 99]:
+            statistics["latency p" + str(percentile)] = float(np.percentile(latencies, percentile)) if len(latencies) else np.nan
+        return statistics
+
+httpClient = HttpClient()
+
+httpCache = HttpCache()     # set to None to always download
+
+def download(url, headers=None, per_host_rate=None):
+    return httpClient.get(url, headers=headers, per_host_rate=per_host_rate)
+
+# Download a page (or take it from httpCache) and return it as text
+# max_age is the age in seconds of a cached page that is still used without asking the server (default: cacheTtls)
+# per_host_rate is the request rate of the download (default: the rate of rateLimiter)
+def fetch_page(url, encoding=None, max_age=None, per_host_rate=None):
+    if httpCache is None:
+        res = download(url, per_host_rate=per_host_rate)
+        res.raise_for_status()
+        content, pageEncoding = res.content, page_encoding(res.headers.get("Content-Type"), res.content) or res.apparent_encoding
+    else:
+        content, pageEncoding = httpCache.fetch(url, lambda url, headers: download(url, headers, per_host_rate), max_age)
+    return content.decode(encoding or pageEncoding or "utf-8", errors="replace")
+
+# Parse downloaded html into its tables once, so that every extractor can share them
+# With tables=(indexes) only those tables are parsed, otherwise all of them with pd.read_html
+def parse_page(html, tables=None):
+    if tables is None:
+        return {"html": html, "tables": pd.read_html(io.StringIO(html))}
+    return {"html": html, "tables": parse_tables(html, tables)}
+
+# Tables used by the extractors on each page
+resultsTables = (6, 9, 10)
+dividendsTables = (5,)
+
+# Download and parse the Kauppalehti results page (tulostiedot) of a company
+def get_results_page(company_id):
+    return parse_page(fetch_page(resultsUrl + company_id), resultsTables)
+
+# Download and parse the Kauppalehti dividend history page (osinkohistoria) of a company
+def get_dividends_page(company_id):
+    return parse_page(fetch_page(dividendsUrl + company_id), dividendsTables)
+
+# ________________________________________________________
+### EXTRACTING TABLES:
+
+# Parse only the tables at the given indexes {index: df}, numbered the way pd.read_html numbers them
+# The cells are read with the rules of pd.read_html: hidden (display:none) tables, rows and cells are left out, <br> is a space,
+# rowspan and colspan cells are repeated, <tfoot> rows come after the body and short rows are filled with NaN
+# Unlike pd.read_html the cells are left as strings for the extractors to convert (pd.read_html converts numeric columns and
+# drops "," from numbers in the others, so "1,5" becomes "15"), and header rows (<thead> or leading rows of <th> cells)
+# are left out instead of becoming column names, the columns are numbered from 0
+def parse_tables(html, indexes):
+    doc = lxml.html.fromstring(html)
+    for br in doc.xpath("*//br"):
+        br.tail = "\n" + (br.tail or "")
+    tables = find_tables(doc)
+    frames = {}
+    for index in indexes:
+        frames[index] = rows_to_frame(tables[index][1])
+    return frames
+
+# Tables with some text and cells left after removing the hidden elements, in document order [(head rows, body rows)]
+def find_tables(doc):
+    tables = []
+    for table in doc.xpath("//table[.//text()[re:test(., '.+')]]", namespaces={"re": "http://exslt.org/regular-expressions"}):
+        if "display:none" in table.get("style", "").replace(" ", ""):
+            continue
+        for elem in table.xpath(".//style"):
+            elem.drop_tree()
+        for elem in table.xpath(".//*[@style]"):
+            if "display:none" in elem.get("style", "").replace(" ", ""):
+                elem.drop_tree()
+        head, body = table_rows(table)
+        if not any(text for row in head + body for text in row):    # pd.read_html skips tables without cells or with only blank cells
+            continue
+        tables.append((head, body))
+    return tables
+
+extraWhitespace = re.compile(r"[\r\n]+|\s{2,}")
+naStrings = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA",
+             "NULL", "NaN", "None", "n/a", "nan", "null"}  # the strings pd.read_html reads as missing
+
+# Texts of the header rows and of the body and footer rows of a table, rowspan and colspan expanded
+def table_rows(table):
+    headRows = []
+    for thead in table.xpath(".//thead"):
+        headRows.extend(thead.xpath("./tr"))
+        if thead.xpath("./td|./th"):    # <thead> with cells but without <tr>
+            headRows.append(thead)
+    bodyRows = table.xpath(".//tbody//tr") + table.xpath("./tr")
+    if len(headRows) == 0:
+        while bodyRows and all(cell.tag == "th" for cell in bodyRows[0].xpath("./td|./th")):
+            headRows.append(bodyRows.pop(0))
+    rows = expand_spans(headRows + bodyRows + table.xpath(".//tfoot//tr"))
+    return rows[:len(headRows)], rows[len(headRows):]
+
+# Cell texts of the rows, the cells of a rowspan or colspan repeated in each row and column they span
+def expand_spans(rows):
+    texts = []
+    remainder = []  # [(column, text, rows left)] of the rowspan cells from the rows above
+    for row in rows:
+        rowTexts = []
+        nextRemainder = []
+        for cell in row.xpath("./td|./th"):
+            while remainder and remainder[0][0] <= len(rowTexts):
+                column, text, rowsLeft = remainder.pop(0)
+                rowTexts.append(text)
+                if rowsLeft > 1:
+                    nextRemainder.append((column, text, rowsLeft - 1))
+            text = extraWhitespace.sub(" ", cell.text_content().strip())
+            rowspan = int(cell.get("rowspan") or 1)
+            for i in range(int(cell.get("colspan") or 1)):
+                if rowspan > 1:
+                    nextRemainder.append((len(rowTexts), text, rowspan - 1))
+                rowTexts.append(text)
+        for column, text, rowsLeft in remainder:
+            rowTexts.append(text)
+            if rowsLeft > 1:
+                nextRemainder.append((column, text, rowsLeft - 1))
+        texts.append(rowTexts)
+        remainder = nextRemainder
+    while remainder:    # rows that only exist because of the rowspans of the last rows
+        texts.append([text for column, text, rowsLeft in remainder])
+        remainder = [(column, text, rowsLeft - 1) for column, text, rowsLeft in remainder if rowsLeft > 1]
+    return texts
+
+def rows_to_frame(rows):
+    width = max([len(row) for row in rows] + [0])
+    data = [[np.nan if text in naStrings else text for text in row] + [np.nan] * (width - len(row)) for row in rows]
+    return pd.DataFrame(data, columns=range(width), dtype=object)
+
+# ________________________________________________________
+### CONSTRUCT DATA FRAMES:
+
+# Years of the column headers of the results tables ("2016", "12/2016", "2016/12") as integers
+def parse_year_labels(labels):
+    years = pd.Series(list(labels), dtype=object).astype(str).str.extract(r"((?:19|20)\d{2})", expand=False)
+    if years.isna().any():
+        raise ValueError("unknown year labels: " + ", ".join(str(label) for label in labels))
+    return list(years.astype("int64"))
+
+def get_turnover_assets_data(company_id, page=None):
+    if page is None:
+        page = get_results_page(company_id)
+    df = page["tables"][6].iloc[[0, 1, 4]]
+    df = df.transpose()
+    df.rename(columns={0:"Year", 1:"Turnover", 4:"Adj. Net Current Assets"}, inplace=True)
+    df = df.iloc[1:]
+    df["Year"] = parse_year_labels(df["Year"])
+    df.set_index("Year", inplace=True)
+    df["Turnover"] = df["Turnover"].str.replace(u'\xa0', '')  # spaces are coded in unicode
+    df["Adj. Net Current Assets"] = df["Adj. Net Current Assets"].str.replace(u'\xa0', '')  # spaces are coded in unicode
+    df = df.apply(pd.to_numeric)   # May cause problems when downloading table values with "-", fix: manually deactivate
+    return df
+
+def get_pe_eps_data(company_id, page=None):
+    if page is None:
+        page = get_results_page(company_id)
+    df = page["tables"][10].iloc[[0, 5, 7, 9]]
+    df = df.transpose()
+    df.rename(columns={0: "Year", 5: "P/B", 7: "P/E", 9: "Earnings per Share"}, inplace=True)
+    df = df.iloc[1:]
+    df["Year"] = parse_year_labels(df["Year"])
+    df.set_index("Year", inplace=True)
+    df = df.apply(pd.to_numeric)   # May cause problems when downloading table values with "-", fix: manually deactivate
+    return df
+
+def get_dividend_data(company_id, page=None):
+    if page is None:
+        page = get_dividends_page(company_id)
+    df = page["tables"][5].rename(columns={0:"Year", 2:"Adj. Dividend"})   # the parsed page may be shared
+    df = df[["Year", "Adj. Dividend"]].iloc[1:]
+    df["Year"] = df["Year"].apply(pd.to_numeric)
+    df.set_index("Year", inplace=True)
+    df = df.apply(pd.to_numeric)    # May cause problems when downloading table values with "-", fix: manually deactivate
+    # Check for duplicated indexes (multiple dividens/year)
+    ar = df.index.duplicated()
+    if True in ar:
+        df = sum_dividends(df)  # method will also convert dividends to numeric
+    return df
+
+def get_current_ratio(company_id, page=None):
+    if page is None:
+        page = get_results_page(company_id)
+    df = page["tables"][9].iloc[[0, 1]]
+    df = df.transpose()
+    df.rename(columns={0: "Year", 1: "Current Ratio"}, inplace=True)
+    df = df.iloc[1:]
+    df["Year"] = parse_year_labels(df["Year"])
+    df.set_index("Year", inplace=True)
+    df = df.apply(pd.to_numeric)  # May cause problems when downloading table values with "-", fix: manually deactivate
+    return df
+
+def get_last_price(company_ticker):
+    url = "http://chartapi.finance.yahoo.com/instrument/1.0/" + company_ticker + ".HE/chartdata;type=quote;range=1m/csv"
+    source_code = fetch_page(url, encoding="latin-1")  # some company names have ääkköset which requires "latin-1" decoding instead of "utf-8"
+    stock_data = []
+    # splitting the data into lines
+    split_source = source_code.split("\n")
+    # unifying the data by removing general info at the top of the csv
+    for line in split_source:
+        split_line = line.split(",")
+        if len(split_line) == 6:  # include only lines with 6 values on it
+            if "values" not in line and "labels" not in line:  # exclude lines with str"Values" included on line
+                stock_data.append(line)
+    # take the data and sort it into respective variables
+    date, closep, highp, lowp, openp, volume = \
+        np.loadtxt(stock_data,
+                   delimiter=",",
+                   unpack=True)
+    return closep[len(stock_data)-1]    # latest stock closing price
+
+quoteUrl = "https://query1.finance.yahoo.com/v7/finance/quote?symbols="
+quoteTtl = 10 * 60  # seconds a quote is reused within a session
+quoteCache = {}     # {ticker: (time, price)}
+
+def yahoo_symbol(company_ticker):
+    return company_ticker.replace(" ", "-") + ".HE"
+
+# Latest prices for many tickers, batch_size tickers per request, returns a Series indexed by ticker
+# Quotes younger than max_age seconds (default: quoteTtl) are taken from quoteCache
+def get_last_prices(tickers, batch_size=50, max_age=None):
+    if max_age is None:
+        max_age = quoteTtl
+    now = time.time()
+    missing = []
+    for ticker in dict.fromkeys(tickers):
+        if ticker not in quoteCache or now - quoteCache[ticker][0] >= max_age:
+            missing.append(ticker)
+    for i in range(0, len(missing), batch_size):
+        batch = missing[i:i + batch_size]
+        symbols = {yahoo_symbol(ticker): ticker for ticker in batch}
+        try:
+            quotes = pd.DataFrame(json.loads(fetch_page(quoteUrl + ",".join(symbols), max_age=max_age))["quoteResponse"]["result"],
+                                  columns=["symbol", "regularMarketPrice"])
+        except Exception as err:
+            print("Could not get prices for: " + ", ".join(batch) + ": " + str(err))
+            continue
+        prices = pd.to_numeric(quotes["regularMarketPrice"], errors="coerce")
+        prices.index = quotes["symbol"].map(symbols)
+        prices = prices[~prices.index.duplicated()]     # a symbol repeated in the response would give a Series per ticker
+        for ticker in batch:
+            quoteCache[ticker] = (now, float(prices.get(ticker, np.nan)))
+    return pd.Series({ticker: quoteCache[ticker][1] if ticker in quoteCache else np.nan for ticker in tickers}, dtype="float64")
+
+# Latest prices as a Series aligned with compTickersDict {compName: ticker}
+def get_price_series(compTickersDict, batch_size=50):
+    prices = get_last_prices(list(compTickersDict.values()), batch_size)
+    return pd.Series([prices[ticker] for ticker in compTickersDict.values()], index=list(compTickersDict.keys()), dtype="float64")
+
+def combine_datasets(one, two, three, four):
+    df = one.join(two, how="outer")
+    df = df.join(three, how="outer")
+    df = df.join(four, how="outer")
+    for col in df.select_dtypes("integer").columns:    # whole numbers are parsed as int64, the checks expect float64
+        df[col] = df[col].astype("float64")
+    return df
+
+# Build the combined company df from one download of the results page and one of the dividend page
+def get_company_data(company_id):
+    return parse_company_pages(company_id, fetch_page(resultsUrl + company_id), fetch_page(dividendsUrl + company_id))
+
+# Build the combined company df from the downloaded html of its results and dividend pages
+def parse_company_pages(company_id, resultsHtml, dividendsHtml):
+    page = parse_page(resultsHtml, resultsTables)
+    return combine_datasets(
+        get_turnover_assets_data(company_id, page),
+        get_pe_eps_data(company_id, page),
+        get_current_ratio(company_id, page),
+        get_dividend_data(company_id, parse_page(dividendsHtml, dividendsTables)))
+
+def get_company_tickers():
+    url = "http://www.nasdaqomxnordic.com/shares/listed-companies/helsinki"
+    doc = lxml.html.fromstring(fetch_page(url))
+    elem = doc.xpath("//tr")
+    # make a list of lists where each item has the cells of one line of the table
+    tableList = []  # list of lists that represents the table
+    headerList = [] # list of table headers
+    for tag in elem[0].xpath(".//th"):
+        headerList.append(tag.text_content())
+    tableList.append(headerList)
+    for line in elem:
+        lineList = []   # list of values that represents one line in the table
+        for tag in line.xpath(".//td"):
+            lineList.append(tag.text_content())
+        tableList.append(lineList)
+    df = pd.DataFrame(tableList)    # is the table as a dataframe w/o headers
+    df.rename(columns={0: "Name", 1: "Symbol", 2: "Currency", 3: "ISIN", 4: "Sector", 5:"ICB Code", 6: "Fact sheet"}, inplace=True)
+    df = df.iloc[2:]
+    df = df[["Name", "Symbol", "ISIN", "Sector", "ICB Code"]]
+    df = df.reset_index(drop=True)
+    return df
+
+stockUrl = "http://www.kauppalehti.fi/5/i/porssi/porssikurssit/osake/index.jsp?klid="
+shareQtyLabels = ["osakemäärä", "osakkeiden määrä", "osakkeiden lukumäärä"]    # row labels of the share count in the stock basic details
+shareQtyUnits = {"": 1, "kpl": 1, "t": 10**3, "tuhatta": 10**3, "milj": 10**6, "miljoonaa": 10**6, "mrd": 10**9, "miljardia": 10**9}
+shareQtyValue = re.compile(r"^(\d{1,3}(?:[ \xa0]\d{3})+|\d+)(?:[,.](\d+))?\s*([^\d\s.]*)\.?(?:\s*kpl\.?)?$", re.I)
+
+# Share count of a value such as "12 345 678", "12 345 678 kpl" or "1,2 milj. kpl", None when it can not be read
+# (an unknown unit, or decimals without a unit)
+def parse_share_value(text):
+    match = shareQtyValue.match(text.strip())
+    if match is None or match.group(3).lower() not in shareQtyUnits:
+        return None
+    whole, decimals, unit = match.group(1), match.group(2) or "", match.group(3).lower()
+    multiplier = shareQtyUnits[unit]
+    if len(decimals) > len(str(multiplier)) - 1:
+        return None     # "1,5" shares or "1,2345 t."
+    return int(re.sub(r"\D", "", whole)) * multiplier + int(decimals or 0) * multiplier // 10 ** len(decimals)
+
+# Number of shares from the stock basic details table of a stock page, None when the page has no share count
+def parse_share_qty(html):
+    doc = lxml.html.fromstring(html)
+    for row in doc.xpath("//tr"):
+        cells = [cell.text_content().strip() for cell in row.xpath("./td|./th")]
+        if len(cells) >= 2 and any(cells[0].lower().startswith(label) for label in shareQtyLabels):
+            shares = parse_share_value(cells[1])
+            if shares is not None:
+                return shares
+    return None
+
+def get_share_qty(company_id, per_host_rate=None):
+    return parse_share_qty(fetch_page(stockUrl + company_id, per_host_rate=per_host_rate))
+
+# ________________________________________________________
+### CREATING PICKLES:
+
+# Create company pickles from live data using existing company_dictionary
+def create_df_pickles(company_dictionary):
+    if not os.path.exists(".\\omxHelAnalysis"):
+        os.makedirs("omxHelAnalysis", exist_ok=True)
+    for compId in company_dictionary.values():
+        try:
+            df = get_company_data(compId)
+            save_df_to_pickle(compId, df)
+            print("Data frame for companyID: " + str(compId) + ", saved to file: " + str(compId) + ".pickle")
+        except Exception as err:
+            print("An exception happened: " + str(err))
+
+def save_df_to_pickle(company_id, df):
+    if not os.path.exists(".\\omxHelAnalysis"):
+        os.makedirs("omxHelAnalysis", exist_ok=True)
+    pickleName = str(company_id) + ".pickle"
+    pickleLocation = ".\\omxHelAnalysis\\" + pickleName
+    df.to_pickle(pickleLocation)
+    record_schema(company_id, df)
+    return pickleName
+
+def load_company_data_pickle(company_id):
+    pickleName = str(company_id) + ".pickle"
+    pickleLocation = ".\\omxHelAnalysis\\" + pickleName
+    df = pd.read_pickle(pickleLocation)
+    return df
+
+# ________________________________________________________
+### PANEL STORE:
+
+# All companies in one (Company ID, Year) x metric panel, saved as a single parquet file
+panelLocation = ".\\omxHelAnalysis\\panel.parquet"
+panelColumns = ["Turnover", "Adj. Net Current Assets", "P/B", "P/E", "Earnings per Share", "Current Ratio", "Adj. Dividend"]
+# Columns every company df should have, checked by validate_company_df, check_for_missing_columns2 and the schema index
+requiredColumns = ["Turnover", "Adj. Net Current Assets", "P/E", "P/B", "Earnings per Share", "Adj. Dividend"]
+
+def empty_panel():
+    index = pd.MultiIndex.from_arrays([pd.Index([], dtype=object), pd.Index([], dtype="int64")], names=["Company ID", "Year"])
+    return pd.DataFrame(columns=panelColumns, index=index, dtype="float64")
+
+# Stack company dfs {compId: df} into a float64 panel sorted by company and latest year first
+# Values that can not be converted to numeric become NaN, use the errorsList checks to find them
+def build_panel(frames):
+    if len(frames) == 0:
+        return empty_panel()
+    panel = pd.concat({str(compId): df for compId, df in frames.items()}, names=["Company ID", "Year"])
+    extraColumns = [col for col in panel.columns if col not in panelColumns]
+    panel = panel.reindex(columns=panelColumns + extraColumns)
+    panel = panel.apply(pd.to_numeric, errors="coerce").astype("float64")
+    panel.index = panel.index.set_levels(panel.index.levels[1].astype("int64"), level="Year")
+    return panel.sort_index(level=["Company ID", "Year"], ascending=[True, False])
+
+def save_panel(panel):
+    if not os.path.exists(".\\omxHelAnalysis"):
+        os.makedirs("omxHelAnalysis", exist_ok=True)
+    panel.to_parquet(panelLocation)
+
+# Load the whole universe with one read
+def load_panel():
+    if not os.path.exists(panelLocation):
+        return empty_panel()
+    return pd.read_parquet(panelLocation)
+
+# Replace the rows of the refreshed companies {compId: df} in the panel store
+def upsert_panel(frames):
+    panel = load_panel()
+    panel = panel.drop([str(compId) for compId in frames.keys()], level="Company ID", errors="ignore")
+    panel = pd.concat([panel, build_panel(frames)])
+    panel = panel.sort_index(level=["Company ID", "Year"], ascending=[True, False])
+    save_panel(panel)
+    return panel
+
+# One-shot import of the existing pickle directory into the panel store
+def import_pickles_to_panel(listOfIds):
+    frames = {}
+    for compId in listOfIds:
+        if os.path.exists(".\\omxHelAnalysis\\" + str(compId) + ".pickle"):
+            frames[compId] = load_company_data_pickle(compId)
+    panel = build_panel(frames)
+    save_panel(panel)
+    return panel
+
+# Company df from the panel with all panelColumns, the extra columns of other companies left out
+def get_company_frame(panel, company_id):
+    df = panel.xs(str(company_id), level="Company ID")
+    extraColumns = [col for col in df.columns if col not in panelColumns and df[col].isna().all()]
+    return df.drop(columns=extraColumns)
+
+# ________________________________________________________
+### CONCURRENT REFRESH:
+
+# Errors worth retrying: connection errors, timeouts and 5xx or 429 responses, not a permanent 404 or 403
+def is_transient(err):
+    if isinstance(err, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(err, requests.HTTPError) and err.response is not None:
+        return err.response.status_code >= 500 or err.response.status_code == 429
+    return False
+
+# Call function(*args), retrying transient network errors with exponential backoff, returns (result, attempts)
+def call_with_retry(function, args, retries=3, backoff=1.0):
+    attempt = 1
+    while True:
+        try:
+            return function(*args), attempt
+        except requests.RequestException as err:
+            if attempt > retries or not is_transient(err):
+                raise
+            time.sleep(backoff * 2 ** (attempt - 1))
+            attempt += 1
+
+# Fetch, parse and save one company, the fetch is recorded with the fingerprint of its pages as in run_ingest_pipeline
+def refresh_company(company_id, retries, backoff, per_host_rate=None):
+    start = time.perf_counter()
+    try:
+        resultsHtml, dividendsHtml, attempts = fetch_company_pages(company_id, retries, backoff, per_host_rate)
+        df = parse_company_pages(company_id, resultsHtml, dividendsHtml)
+        save_df_to_pickle(company_id, df)
+        record_fetch(company_id, page_fingerprint(resultsHtml, dividendsHtml))
+        return {"ok": True, "attempts": attempts, "error": None, "seconds": time.perf_counter() - start}, df
+    except Exception as err:
+        return {"ok": False, "attempts": None, "error": str(err), "seconds": time.perf_counter() - start}, None
+
+# Refresh company pickles concurrently, returns a report {compId: {"ok", "attempts", "error", "seconds"}}
+# Refreshed companies are also upserted into the panel store in one write
+def refresh_company_pickles(listOfIds, max_workers=8, per_host_rate=4.0, retries=3, backoff=1.0, update_panel=True):
+    if not os.path.exists(".\\omxHelAnalysis"):
+        os.makedirs("omxHelAnalysis", exist_ok=True)
+    report = {}
+    frames = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(refresh_company, compId, retries, backoff, per_host_rate): compId for compId in listOfIds}
+        for future in as_completed(futures):
+            compId = futures[future]
+            report[compId], df = future.result()
+            if report[compId]["ok"]:
+                frames[compId] = df
+                print("Data frame for companyID: " + str(compId) + ", saved to file: " + str(compId) + ".pickle")
+            else:
+                print("An exception happened with companyID: " + str(compId) + ": " + report[compId]["error"])
+    if update_panel and frames:
+        upsert_panel(frames)
+    return report
+
+# Concurrent version of create_df_pickles
+def create_df_pickles_concurrent(company_dictionary, **options):
+    return refresh_company_pickles(list(company_dictionary.values()), **options)
+
+def print_refresh_report(report):
+    failed = [compId for compId in report if not report[compId]["ok"]]
+    print("Refreshed: " + str(len(report) - len(failed)) + ", failed: " + str(len(failed)))
+    for compId in failed:
+        print(str(compId) + ": " + report[compId]["error"])
+    for compId in flagged_companies(report):
+        print(str(compId) + " saved with problems: " + ", ".join(report[compId]["problems"]))
+
+# Companies that were saved but did not pass validation
+def flagged_companies(report):
+    return [compId for compId in report if report[compId]["ok"] and report[compId].get("problems")]
+
+# The errorsList after a refresh: the companies that were parsed and validated again leave it, those failing validation join it
+# Companies skipped as unchanged keep their place, their saved df was not checked again
+def merge_flagged_companies(errorsList, report):
+    validated = [compId for compId in report if report[compId]["ok"] and not report[compId].get("unchanged")]
+    return [compId for compId in errorsList if compId not in validated] + flagged_companies(report)
+
+# ________________________________________________________
+### INGEST PIPELINE:
+
+# Check a freshly built company df, returns a list of problems (same checks as check_for_missing_columns2 and check_df_for_float64)
+def validate_company_df(df):
+    problems = []
+    for col in requiredColumns:
+        if col not in list(df.columns.values):
+            problems.append("missing column " + col)
+    for col in list(df.columns.values):
+        if check_column_dtype(df, col) != np.dtype("float64"):
+            problems.append(col + " is not float64")
+    return problems
+
+def fetch_company_pages(company_id, retries, backoff, per_host_rate=None):
+    resultsHtml, attempts = call_with_retry(fetch_page, (resultsUrl + company_id, None, None, per_host_rate), retries, backoff)
+    dividendsHtml, more = call_with_retry(fetch_page, (dividendsUrl + company_id, None, None, per_host_rate), retries, backoff)
+    return resultsHtml, dividendsHtml, attempts + more - 1
+
+# Streaming refresh: fetch (threads) -> parse (process pool) -> validate -> store
+# The queues between the stages are bounded by queue_size, so a slow stage holds back the fetching
+# Returns the same report as refresh_company_pickles with the validation problems of each company
+# Companies whose pages have the same fingerprint as on the last fetch are not parsed again (skip_unchanged),
+# except for the companies in reparse
+# With share_counts the share count of each company is fetched from its stock page into the company index
+def run_ingest_pipeline(listOfIds, fetch_workers=8, parse_workers=None, queue_size=16, per_host_rate=4.0, retries=3, backoff=1.0, update_panel=True, skip_unchanged=True, share_counts=True, reparse=()):
+    if not os.path.exists(".\\omxHelAnalysis"):
+        os.makedirs("omxHelAnalysis", exist_ok=True)
+    listOfIds = list(listOfIds)
+    reparse = set(reparse)
+    fetched = queue.Queue(maxsize=queue_size)   # (compId, html, html, attempts) or (compId, error)
+    index = read_company_index() if skip_unchanged else {}     # read once for is_unchanged
+    stop = threading.Event()    # set when the consumer fails, the fetch threads then stop instead of blocking on the full queue
+    started = {}
+    report = {}
+    frames = {}
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                fetched.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def fetch(compId):
+        if stop.is_set():
+            return
+        started[compId] = time.perf_counter()
+        if share_counts:
+            try:
+                record_share_qty(compId, call_with_retry(get_share_qty, (compId, per_host_rate), retries, backoff)[0])
+            except Exception as err:
+                print("Could not get the share count of companyID: " + str(compId) + ": " + str(err))
+        try:
+            put((compId,) + fetch_company_pages(compId, retries, backoff, per_host_rate))
+        except Exception as err:
+            put((compId, err))
+
+    def store(compId, attempts, fingerprint, future):
+        try:
+            df = future.result()
+            problems = validate_company_df(df)
+            save_df_to_pickle(compId, df)
+            record_fetch(compId, fingerprint)
+            frames[compId] = df
+            report[compId] = {"ok": True, "attempts": attempts, "error": None, "problems": problems}
+        except Exception as err:
+            report[compId] = {"ok": False, "attempts": attempts, "error": str(err), "problems": []}
+        report[compId]["seconds"] = time.perf_counter() - started[compId]
+        if report[compId]["ok"]:
+            print("Data frame for companyID: " + str(compId) + ", saved to file: " + str(compId) + ".pickle")
+        else:
+            print("An exception happened with companyID: " + str(compId) + ": " + report[compId]["error"])
+
+    with ThreadPoolExecutor(max_workers=fetch_workers) as fetchers, ProcessPoolExecutor(max_workers=parse_workers) as parsers:
+        try:
+            for compId in listOfIds:
+                fetchers.submit(fetch, compId)
+            parsing = {}    # {future: (compId, attempts, fingerprint)}
+            for i in range(len(listOfIds)):
+                item = fetched.get()
+                if len(item) == 2:
+                    compId, err = item
+                    report[compId] = {"ok": False, "attempts": None, "error": str(err), "problems": [],
+                                      "seconds": time.perf_counter() - started[compId]}
+                    print("An exception happened with companyID: " + str(compId) + ": " + str(err))
+                    continue
+                compId, resultsHtml, dividendsHtml, attempts = item
+                fingerprint = page_fingerprint(resultsHtml, dividendsHtml)
+                if skip_unchanged and compId not in reparse and is_unchanged(compId, fingerprint, index):
+                    record_fetch(compId, fingerprint)
+                    report[compId] = {"ok": True, "attempts": attempts, "error": None, "problems": [], "unchanged": True,
+                                      "seconds": time.perf_counter() - started[compId]}
+                    print("Data for companyID: " + str(compId) + " has not changed")
+                    continue
+                parsing[parsers.submit(parse_company_pages, compId, resultsHtml, dividendsHtml)] = (compId, attempts, fingerprint)
+                if len(parsing) >= queue_size:
+                    done, pending = wait(parsing, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        store(*parsing.pop(future), future)
+            for future in as_completed(list(parsing)):
+                store(*parsing.pop(future), future)
+        except BaseException:
+            # Without this the executors would wait forever on the fetch threads blocked on the full queue
+            stop.set()
+            fetchers.shutdown(wait=False, cancel_futures=True)
+            raise
+    if update_panel and frames:
+        upsert_panel(frames)
+    return report
+
+# ________________________________________________________
+### INCREMENTAL REFRESH:
+
+# Fetch records {compId: {"fetched": time, "fingerprint": sha1 of the pages, "latestYear": latest reported year,
+#                         "saved": time, "schema": describe_company_df of the saved df, "shares": share count, "sharesFetched": time}}
+companyIndexLocation = ".\\omxHelAnalysis\\companyIndex"
+companyIndexLock = threading.Lock()
+refreshTtlDays = 30     # refetch data older than this
+reportingMonth = 4      # annual results of the previous year are expected out from this month on
+parserVersion = 2       # part of the fingerprint, increase when parse_company_pages changes so that unchanged pages are parsed again
+
+def page_fingerprint(*htmls):
+    return hashlib.sha1((str(parserVersion) + "".join(htmls)).encode("utf-8")).hexdigest()
+
+# Latest year with financials (turnover or earnings) in a company df
+def latest_reported_year(df):
+    columns = [col for col in ["Turnover", "Earnings per Share"] if col in df.columns]
+    years = df.index[df[columns].notna().any(axis=1)] if columns else df.index
+    return int(years.max()) if len(years) > 0 else None
+
+def read_company_index():
+    with companyIndexLock:
+        if not os.path.exists(".\\omxHelAnalysis"):
+            os.makedirs("omxHelAnalysis", exist_ok=True)
+        with shelve.open(companyIndexLocation) as index:
+            return dict(index)
+
+# Record a fetch of a company, the latest year is recorded when the df is saved
+def record_fetch(company_id, fingerprint):
+    with companyIndexLock:
+        if not os.path.exists(".\\omxHelAnalysis"):
+            os.makedirs("omxHelAnalysis", exist_ok=True)
+        with shelve.open(companyIndexLocation) as index:
+            record = index.get(str(company_id), {})
+            record["fetched"] = time.time()
+            record["fingerprint"] = fingerprint
+            index[str(company_id)] = record
+
+# Record the share count of a company, None when its page had none
+def record_share_qty(company_id, shares):
+    with companyIndexLock:
+        if not os.path.exists(".\\omxHelAnalysis"):
+            os.makedirs("omxHelAnalysis", exist_ok=True)
+        with shelve.open(companyIndexLocation) as index:
+            record = index.get(str(company_id), {})
+            record["shares"] = shares
+            record["sharesFetched"] = time.time()
+            index[str(company_id)] = record
+
+# Share counts from the company index {compId: shares}, companies without one are left out
+def read_share_counts(listOfIds):
+    index = read_company_index()
+    shares = {}
+    for compId in listOfIds:
+        if index.get(str(compId), {}).get("shares") is not None:
+            shares[compId] = index[str(compId)]["shares"]
+    return shares
+
+# Fetch the share counts of many companies concurrently (through the http cache) into the company index
+# Returns {compId: shares or error}
+def refresh_share_counts(listOfIds, max_workers=8, per_host_rate=4.0, retries=3, backoff=1.0):
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(call_with_retry, get_share_qty, (compId, per_host_rate), retries, backoff): compId for compId in listOfIds}
+        for future in as_completed(futures):
+            compId = futures[future]
+            try:
+                results[compId] = future.result()[0]
+                record_share_qty(compId, results[compId])
+            except Exception as err:
+                results[compId] = err
+                print("Could not get the share count of companyID: " + str(compId) + ": " + str(err))
+    return results
+
+# index is the company index as read by read_company_index at the start of the refresh
+def is_unchanged(company_id, fingerprint, index):
+    record = index.get(str(company_id), {})
+    pickleLocation = ".\\omxHelAnalysis\\" + str(company_id) + ".pickle"
+    return record.get("fingerprint") == fingerprint and os.path.exists(pickleLocation)
+
+# The latest financial year that should be reported by now
+def expected_reported_year(now=None):
+    now = time.localtime(now)
+    if now.tm_mon >= reportingMonth:
+        return now.tm_year - 1
+    return now.tm_year - 2
+
+# Time from which the results of the expected year have been due
+def reporting_period_start(now=None):
+    return time.mktime((expected_reported_year(now) + 1, reportingMonth, 1, 0, 0, 0, 0, 0, -1))
+
+# Work out which companies need to be refetched, returns {compId: reason}
+def companies_needing_refresh(listOfIds, ttl_days=refreshTtlDays, now=None):
+    if now is None:
+        now = time.time()
+    index = read_schema_index(listOfIds)
+    expectedYear = expected_reported_year(now)
+    periodStart = reporting_period_start(now)
+    needing = {}
+    for compId in listOfIds:
+        record = index.get(str(compId))
+        pickleLocation = ".\\omxHelAnalysis\\" + str(compId) + ".pickle"
+        if not os.path.exists(pickleLocation):
+            needing[compId] = "no data"
+        elif "fetched" not in record:
+            needing[compId] = "no fetch record"
+        elif now - record["fetched"] > ttl_days * 24 * 3600:
+            needing[compId] = "older than " + str(ttl_days) + " days"
+        elif record.get("latestYear") is not None and record["latestYear"] < expectedYear and record["fetched"] < periodStart:
+            needing[compId] = "new reporting period " + str(expectedYear)
+        elif schema_missing_columns(record["schema"]):
+            needing[compId] = "missing columns"
+        elif schema_bad_dtypes(record["schema"]):
+            needing[compId] = "not float64"
+    return needing
+
+# Reasons that come from the parsed df, these companies are parsed again even when their pages have not changed
+reparseReasons = ["missing columns", "not float64"]
+
+# Refetch only the companies that are stale or incomplete, returns ({compId: reason}, pipeline report)
+def incremental_refresh(listOfIds, ttl_days=refreshTtlDays, **options):
+    needing = companies_needing_refresh(listOfIds, ttl_days)
+    for compId in needing.keys():
+        print("Refreshing companyID: " + str(compId) + " (" + needing[compId] + ")")
+    reparse = [compId for compId in needing.keys() if needing[compId] in reparseReasons]
+    report = run_ingest_pipeline(list(needing.keys()), reparse=reparse, **options)
+    return needing, report
+
+# ________________________________________________________
+### SCHEMA INDEX:
+
+# The schema of every saved df is kept in the company index, so that the checks for
+# missing data, dtypes and columns are index queries instead of loading every pickle
+
+def pickle_modified(company_id):
+    try:
+        return os.path.getmtime(".\\omxHelAnalysis\\" + str(company_id) + ".pickle")
+    except OSError:
+        return None
+
+# Columns, dtypes, year coverage and NaN counts of a company df
+def describe_company_df(df):
+    years = pd.to_numeric(pd.Series(df.index), errors="coerce").dropna()
+    return {"columns": list(df.columns),
+            "dtypes": {col: str(check_column_dtype(df, col)) for col in df.columns},
+            "years": sorted(int(year) for year in years),
+            "nanCounts": {col: int(count) for col, count in df.isna().sum().items()}}
+
+# Record the schema of a saved df, called by save_df_to_pickle, returns the updated record
+def record_schema(company_id, df):
+    schema = describe_company_df(df)
+    schema["modified"] = pickle_modified(company_id)
+    latestYear = latest_reported_year(df)
+    with companyIndexLock:
+        with shelve.open(companyIndexLocation) as index:
+            record = index.get(str(company_id), {})
+            record["saved"] = time.time()
+            record["schema"] = schema
+            record["latestYear"] = latestYear
+            index[str(company_id)] = record
+    return record
+
+# The company index with an up to date schema for every given company that has a pickle
+# Only pickles saved before the schema index (or changed outside save_df_to_pickle) are read
+def read_schema_index(listOfIds):
+    index = read_company_index()
+    for compId in listOfIds:
+        record = index.get(str(compId), {})
+        modified = pickle_modified(compId)
+        if modified is None:
+            record.pop("schema", None)
+        elif record.get("schema", {}).get("modified") != modified:
+            record = record_schema(compId, load_company_data_pickle(compId))
+        index[str(compId)] = record
+    return index
+
+def schema_missing_columns(schema):
+    return [col for col in requiredColumns if col not in schema["columns"]]
+
+def schema_bad_dtypes(schema):
+    return [col for col, dtype in schema["dtypes"].items() if dtype != "float64"]
+
+# Same problems as validate_company_df, from the schema
+def schema_problems(schema):
+    problems = ["missing column " + col for col in schema_missing_columns(schema)]
+    return problems + [col + " is not float64" for col in schema_bad_dtypes(schema)]
+
+# Problems of each company {compId: [problem]}, companies without a df have "no data frame"
+def index_problems(listOfIds):
+    index = read_schema_index(listOfIds)
+    problems = {}
+    for compId in listOfIds:
+        if "schema" not in index[str(compId)]:
+            problems[compId] = ["no data frame"]
+        else:
+            problems[compId] = schema_problems(index[str(compId)]["schema"])
+    return problems
+
+def list_missing_data(listOfIds):
+    return [compId for compId, problems in index_problems(listOfIds).items() if "no data frame" in problems]
+
+def list_bad_dtypes(listOfIds):
+    index = read_schema_index(listOfIds)
+    return [compId for compId in listOfIds if "schema" in index[str(compId)] and schema_bad_dtypes(index[str(compId)]["schema"])]
+
+def list_missing_columns(listOfIds):
+    index = read_schema_index(listOfIds)
+    return [compId for compId in listOfIds if "schema" in index[str(compId)] and schema_missing_columns(index[str(compId)]["schema"])]
+
+# One row per company: columns, year coverage, NaN cells and the fetch and save times
+def schema_index_frame(listOfIds):
+    index = read_schema_index(listOfIds)
+    rows = []
+    for compId in listOfIds:
+        record = index[str(compId)]
+        schema = record.get("schema")
+        rows.append({"Company ID": compId,
+                     "Columns": len(schema["columns"]) if schema else 0,
+                     "First Year": min(schema["years"]) if schema and schema["years"] else None,
+                     "Last Year": max(schema["years"]) if schema and schema["years"] else None,
+                     "Years": len(schema["years"]) if schema else 0,
+                     "NaN Cells": sum(schema["nanCounts"].values()) if schema else None,
+                     "Latest Reported Year": record.get("latestYear"),
+                     "Fetched": record.get("fetched"), "Saved": record.get("saved")})
+    frame = pd.DataFrame(rows).set_index("Company ID")
+    for col in ["Fetched", "Saved"]:
+        frame[col] = pd.to_datetime(frame[col], unit="s")
+    return frame
+
+# ________________________________________________________
+### GENERATING COMPANY DICTIONARIES:
+
+listingUrl = "http://www.kauppalehti.fi/5/i/porssi/porssikurssit/"
+
+# Company links of the listing page {compId: link text}, in page order without duplicates
+def get_company_links():
+    doc = lxml.html.fromstring(fetch_page(listingUrl))
+    endsWithNumber = re.compile(r'\d{4}$')
+    links = {}
+    for link in doc.xpath("//a[@href]"):
+        mo = endsWithNumber.search(link.get("href"))
+        if mo != None and mo.group() not in links:
+            links[mo.group()] = link.text_content().strip()
+    return links
+
+# Getting company IDs:
+def get_company_id_list():
+    return list(get_company_links())
+
+
+# Create dictionary with structure {compName : compTickers["Symbol"]
+# compName without the symbol in parenthesis, unmatched names are printed
+def create_company_symbol_dictionary(compDict, compTickersDf):
+    dictionary, unmatched = TickerMatcher(compTickersDf).match_all(compDict.keys())
+    print("missing dictiotionary")
+    pprint.pprint([split_company_name(compName)[0] for compName in unmatched])
+    return {split_company_name(compName)[0]: symbol for compName, symbol in dictionary.items()}
+
+# Create dictionary with structure {compDict.keys() : compTickers["Symbol"]
+def create_company_symbol_dictionary2(compDict, compTickersDf):
+    return TickerMatcher(compTickersDf).match_all(compDict.keys())[0]
+
+# Getting company name:
+def get_company_name(company_id, page=None):
+    if page is None:
+        page = {"html": fetch_page(resultsUrl + company_id)}   # the name needs no table parsing
+    return lxml.html.fromstring(page["html"]).xpath("//h1")[1].text_content()
+
+# Create a dictionary in the format {companyName:CompanyId}
+# Only the companies that are new to the company registry have their names downloaded
+def company_dictionary(**options):
+    registry, errors = update_company_registry(**options)
+    dictionary = {}
+    for compId, compName in registry["companies"].items():
+        dictionary[compName] = compId
+    return dictionary
+
+# Create a dictionary of company dataframes {companyName:df_pickle_Name}
+def dataFrame_dictionary(compDictionary):
+    dictionary = {}
+    for compName in list(compDictionary.keys()):
+        dictionary[compName] = get_company_data(compDictionary[compName])
+    return dictionary
+
+def get_price_dictionary(compTickersDict):
+    dictionary = get_price_series(compTickersDict).to_dict()
+    for stock in dictionary.keys():
+        if np.isnan(dictionary[stock]):
+            print("Could not get price for: " + str(stock))
+    return dictionary
+
+# ________________________________________________________
+### COMPANY DISCOVERY:
+
+# Versioned registry of the listed companies {"version": n, "updated": time, "companies": {compId: compName},
+# "history": [{"version", "updated", "added", "removed", "renamed"}]}, a new version is saved when the companies change
+companyRegistryLocation = ".\\omxHelAnalysis\\companyRegistry"
+
+# Download the names of many companies concurrently, returns ({compId: compName}, {compId: error})
+def get_company_names(listOfIds, max_workers=8):
+    names = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(call_with_retry, get_company_name, (compId,)): compId for compId in listOfIds}
+        for future in as_completed(futures):
+            compId = futures[future]
+            try:
+                names[compId] = future.result()[0]
+            except Exception as err:
+                errors[compId] = str(err)
+                print("Could not get the name of companyID: " + str(compId) + ": " + str(err))
+    return names, errors
+
+def read_company_registry():
+    if not os.path.exists(".\\omxHelAnalysis"):
+        os.makedirs("omxHelAnalysis", exist_ok=True)
+    with shelve.open(companyRegistryLocation) as registry:
+        return {"version": registry.get("version", 0), "updated": registry.get("updated"),
+                "companies": registry.get("companies", {}), "history": registry.get("history", [])}
+
+# Bring the registry up to date with the listing page
+# Names are downloaded only for new companies (all with refresh_names), with names_from_listing the link texts are used instead
+# Returns (registry, {compId: error} of the names that could not be downloaded)
+def update_company_registry(max_workers=8, refresh_names=False, names_from_listing=False):
+    links = get_company_links()
+    registry = read_company_registry()
+    known = registry["companies"]
+    if refresh_names:
+        newIds = list(links)
+    else:
+        newIds = [compId for compId in links if compId not in known]
+    if names_from_listing:
+        names = {compId: links[compId] for compId in newIds if links[compId]}
+        names2, errors = get_company_names([compId for compId in newIds if compId not in names], max_workers)
+        names.update(names2)
+    else:
+        names, errors = get_company_names(newIds, max_workers)
+    companies = {}
+    for compId in links:
+        if compId in names:
+            companies[compId] = names[compId]
+        elif compId in known:   # keep the old name when the download failed
+            companies[compId] = known[compId]
+    added = [compId for compId in companies if compId not in known]
+    removed = [compId for compId in known if compId not in links]
+    renamed = {compId: [known[compId], companies[compId]] for compId in companies if compId in known and known[compId] != companies[compId]}
+    if added or removed or renamed or registry["version"] == 0:
+        registry["version"] += 1
+        registry["updated"] = time.time()
+        registry["companies"] = companies
+        registry["history"].append({"version": registry["version"], "updated": registry["updated"],
+                                    "added": added, "removed": removed, "renamed": renamed})
+        with shelve.open(companyRegistryLocation) as shelf:
+            for key in ["version", "updated", "companies", "history"]:
+                shelf[key] = registry[key]
+        print("Company registry version " + str(registry["version"]) + ": " + str(len(added)) + " added, "
+              + str(len(removed)) + " removed, " + str(len(renamed)) + " renamed")
+    return registry, errors
+
+# ________________________________________________________
+### TICKER MATCHING:
+
+# Kauppalehti names are "Company Name (SYMBOL)", the Nasdaq listing (get_company_tickers) has Name, Symbol and ISIN
+symbolInParenthesis = re.compile(r"^(.*?)\s*\(([^()]*)\)\s*$")
+isinPattern = re.compile(r"^[A-Z]{2}[A-Z0-9]{9}[0-9]$")
+legalForms = {"oyj", "abp", "ab", "oy", "plc", "asa", "as", "sa", "ltd", "inc", "corp", "corporation", "publ", "group"}
+
+def split_company_name(compName):
+    mo = symbolInParenthesis.search(compName)
+    if mo is None:
+        return compName.strip(), None
+    return mo.group(1), mo.group(2)
+
+# Lower case ascii words without the legal form, "Stockmann Oyj Abp" and "Stockmann" give "stockmann"
+def normalize_company_name(name):
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii").lower()
+    words = re.findall(r"[a-z0-9]+", name.replace("&", " and "))
+    return " ".join(word for word in words if word not in legalForms)
+
+def normalize_symbol(symbol):
+    return re.sub(r"[^A-Z0-9]", "", symbol.upper())
+
+# Matches Kauppalehti company names to the symbols of the Nasdaq listing
+# The lookups are built once: normalized name, ISIN, symbol and symbol without the share class
+# Names that miss all of them get the closest listed name above cutoff (difflib)
+class TickerMatcher:
+    def __init__(self, compTickersDf, cutoff=0.85):
+        self.cutoff = cutoff
+        self.byName = {}        # {normalized name: symbol}
+        self.byIsin = {}        # {isin: symbol}
+        self.bySymbol = {}      # {normalized symbol: symbol}
+        self.byBaseSymbol = {}  # {symbol without share class: [symbol]}
+        for name, symbol, isin in compTickersDf[["Name", "Symbol", "ISIN"]].itertuples(index=False):
+            if not isinstance(symbol, str) or symbol.strip() == "":
+                continue
+            if isinstance(name, str):
+                self.byName.setdefault(normalize_company_name(name), symbol)
+            if isinstance(isin, str):
+                self.byIsin.setdefault(isin.strip().upper(), symbol)
+            self.bySymbol.setdefault(normalize_symbol(symbol), symbol)
+            self.byBaseSymbol.setdefault(normalize_symbol(symbol.split()[0]), []).append(symbol)
+        self.names = list(self.byName.keys())
+
+    # Returns (symbol, how it was matched), (None, None) when there is no match
+    def match(self, compName, isin=None):
+        name, symbol = split_company_name(compName)
+        for candidate in [isin, symbol, name]:
+            if isinstance(candidate, str) and isinPattern.match(candidate.strip().upper()) \
+                    and candidate.strip().upper() in self.byIsin:
+                return self.byIsin[candidate.strip().upper()], "isin"
+        key = normalize_company_name(name)
+        if key in self.byName:
+            return self.byName[key], "name"
+        if symbol:
+            if normalize_symbol(symbol) in self.bySymbol:
+                return self.bySymbol[normalize_symbol(symbol)], "symbol"
+            if len(self.byBaseSymbol.get(normalize_symbol(symbol), [])) == 1:   # only one share class listed
+                return self.byBaseSymbol[normalize_symbol(symbol)][0], "symbol"
+        close = difflib.get_close_matches(key, self.names, n=1, cutoff=self.cutoff)
+        if close:
+            return self.byName[close[0]], "fuzzy"
+        return None, None
+
+    # Match all names in one pass, returns ({compName: symbol}, [unmatched compName])
+    def match_all(self, compNames, isins=None):
+        if isins is None:
+            isins = {}
+        dictionary = {}
+        unmatched = []
+        for compName in compNames:
+            symbol, method = self.match(compName, isins.get(compName))
+            if symbol is None:
+                unmatched.append(compName)
+            else:
+                dictionary[compName] = symbol
+        return dictionary, unmatched
+
+    # One row per name: the matched symbol and how it was matched
+    def report(self, compNames):
+        rows = []
+        for compName in compNames:
+            symbol, method = self.match(compName)
+            rows.append({"Company": compName, "Symbol": symbol, "Match": method})
+        return pd.DataFrame(rows, columns=["Company", "Symbol", "Match"]).set_index("Company")
+
+# ________________________________________________________
+### ERROR CHECKING:
+def list_missing_df(compDictionary):
+    missingIds = []
+    for compName in compDictionary.keys():
+        company_id = compDictionary[compName]
+        pickleName = str(company_id) + ".pickle"
+        pickleLocation = ".\\omxHelAnalysis\\" + pickleName
+        if not os.path.exists(pickleLocation):
+            missingIds.append(company_id)
+            print("Missing data for company: " + compName + ", id: " + company_id)
+    return missingIds
+
+def create_df_pickles_from_Idlist(listOfIds):
+    for compId in listOfIds:
+        try:
+            df = get_company_data(compId)
+            save_df_to_pickle(compId, df)
+            print("Data frame for companyID: " + str(compId) + ", saved to file: " + str(compId) + ".pickle")
+        except Exception as err:
+            print("An exception happened: " + str(err))
+
+# Create errorList by checking each df for errors
+def create_errorList(ListOfIds):
+    errorsList = []
+    for compId in ListOfIds:
+        df = load_company_data_pickle(compId)
+        for col in list(df.columns.values):
+            try:
+                df[col] = df[col].apply(pd.to_numeric)
+            except Exception as err:
+                print("An exception happened: " + str(err))
+                errorsList.append(compId)
+    errorsList = list(set(errorsList))  # Removes duplicated values from the list
+    return errorsList
+
+# Create errorList from the dtypes in the schema index, without loading the pickles like create_errorList
+def create_errorList2(ListOfIds):
+    errorsList = list_bad_dtypes(ListOfIds)
+    errorsList = list(set(errorsList))  # Removes duplicated values from the list
+    return errorsList
+
+# Check df if all columns have dtype=float64
+def check_df_for_float64(compId):
+    df = load_company_data_pickle(compId)
+    res = True
+    for col in list(df.columns.values):
+        if check_column_dtype(df, col) != np.dtype("float64"):
+            res = False
+    return res
+
+# Check data type for column
+def check_column_dtype(df, column):
+    return np.array(df[column]).dtype
+
+# Check if df is missing some columns
+def check_for_missing_columns(df):
+    count = 0
+    if len(list(df.columns.values)) < len(requiredColumns):
+        count += 1
+    else:
+        for col in list(df.columns.values):
+            if col not in requiredColumns:
+                count += 1
+    if count > 1:
+        return True
+    else:
+        return False
+
+# Check if df is missing some columns
+def check_for_missing_columns2(df):
+    count = 0
+    for col in requiredColumns:
+        if col not in list(df.columns.values):
+            count += 1
+    if count > 0:
+        return True
+    else:
+        return False
+
+# ________________________________________________________
+### ERROR HANDLING:
+
+# Changing df to numeric and removing unicode character \xa0
+def convert_pickled_df_to_numeric(compId):
+    df = load_company_data_pickle(compId)
+    for col in list(df.columns.values):
+        try:
+            df[col] = df[col].str.replace(u'\xa0', '')  # spaces are coded in unicode
+            df[col] = df[col].apply(pd.to_numeric)  # converts values to numeric
+        except Exception as err:
+            print("An exception occurred: " + str(err))
+            if compId != None:
+                print(compId)
+    return df
+
+# Changing values in dfs
+def convert_column_error_to_NaN(compId, column):
+    df = load_company_data_pickle(compId)
+    df[column] = pd.to_numeric(df[column], errors="coerce")
+    return df
+
+def convert_column_unicode_thousand(compId, column):
+    df = load_company_data_pickle(compId)
+    df[column] = df[column].str.replace(u'\xa0', '')  # spaces are coded in unicode
+    df[column] = pd.to_numeric(df[column])
+    return df
+
+# Changing all values in dfs to numeric with coerce
+def convert_error_to_NaN_coerce(compId):
+    df = load_company_data_pickle(compId)
+    for col in list(df.columns.values):
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df
+
+# Replacing "-" with NaN-values
+def convert_line_to_empty(compId):
+    df = load_company_data_pickle(compId)
+    for col in list(df.columns.values):
+        try:
+            df[col] = df[col].str.replace('-', "")
+        except Exception as err:
+            print("An exception occurred: " + str(err))
+            if compId != None:
+                print(compId)
+    return df
+
+# In case of multiple dividends sum them up to one index value (year)
+def sum_dividends(df):
+    df = df.apply(pd.to_numeric)  # converts values to numeric
+    df = df.groupby(df.index).sum() # sum all values together that have same index value
+    return df
+
+# Rename keys in a dictionary
+def rename_dict_keys(dictionary):
+    for key in dictionary.keys():
+        print(key)
+        rename = input("Do you want to rename key? (input_new_key/n)")
+        if rename != "n":
+            dictionary[rename] = dictionary.pop[key]
+    return dictionary
+
+# update values in a df column
+def change_column_values(df, column):
+    i = 0
+    while i < len(df):
+        a = df.iloc[i][column]
+        print(a)
+        b = input("rename: (empty/input)")  # will take any non empty string as the new value for the df cell
+        if b != "":
+            df.set_value(i, column, b)
+            print(df.iloc[i][column])
+        i += 1
+    return df
+
+
+# ________________________________________________________
+### BULK CLEANING:
+
+# Clean the dfs of many companies in one pass over all their cells:
+# strip the \xa0 thousand separators, "-" to NaN, everything else that is not a number to NaN, all columns to float64
+# and sum the dividends of duplicated years like sum_dividends (the other columns are repeated on those rows, the first is kept)
+# Returns ({compId: cleaned df}, changes with one row per changed cell)
+def clean_frames(frames):
+    changeColumns = ["Company ID", "Year", "Column", "Before", "After", "Change"]
+    if not frames:
+        return {}, pd.DataFrame(columns=changeColumns)
+    wide = pd.concat({compId: df.astype(object) for compId, df in frames.items()}, names=["Company ID", "Year"])
+    cells = pd.Series(wide.to_numpy(dtype=object).ravel())
+    isText = cells.map(lambda value: isinstance(value, str))
+    before = cells.astype(str)
+    text = before.str.replace(u'\xa0', '', regex=False).str.strip()
+    dash = isText & (text == "-")
+    numbers = pd.to_numeric(text.mask(dash), errors="coerce").astype("float64")
+    change = np.select([dash, isText & numbers.isna(), isText & (text != before), isText],
+                       ["dash to NaN", "not a number to NaN", "thousand separator", "text to number"], "")
+    rows, cols = np.divmod(np.flatnonzero(isText), len(wide.columns))
+    changes = pd.DataFrame({"Company ID": wide.index.get_level_values("Company ID")[rows],
+                            "Year": wide.index.get_level_values("Year")[rows],
+                            "Column": wide.columns[cols], "Before": cells[isText].to_numpy(),
+                            "After": numbers[isText].to_numpy(), "Change": change[isText.to_numpy()]})
+
+    cleaned = pd.DataFrame(numbers.to_numpy().reshape(wide.shape), index=wide.index, columns=wide.columns)
+    duplicated = cleaned.index.duplicated(keep=False)
+    if duplicated.any():
+        aggregations = {col: "first" for col in cleaned.columns}
+        if "Adj. Dividend" in cleaned.columns:
+            aggregations["Adj. Dividend"] = lambda values: values.sum(min_count=1)
+        collapsed = cleaned[duplicated].groupby(level=["Company ID", "Year"], sort=False).agg(aggregations)
+        dividends = cleaned[duplicated].groupby(level=["Company ID", "Year"], sort=False)["Adj. Dividend"].agg(list) \
+            if "Adj. Dividend" in cleaned.columns else pd.Series(dtype=object)
+        summed = pd.DataFrame({"Column": "Adj. Dividend", "Before": dividends.astype(str),
+                               "After": collapsed.get("Adj. Dividend"), "Change": "duplicate year summed"})
+        changes = pd.concat([changes, summed.reset_index()], ignore_index=True)
+        cleaned = pd.concat([cleaned[~duplicated], collapsed])
+
+    result = {}
+    for compId, df in frames.items():
+        companyFrame = cleaned.xs(compId, level="Company ID")[list(df.columns)]
+        result[compId] = companyFrame.reindex(df.index[~df.index.duplicated()]).astype("float64")
+    return result, changes[changeColumns]
+
+# Clean the pickles of the given companies in one pass and save the ones that changed
+# Returns the changes, with dry_run nothing is saved
+def clean_company_pickles(listOfIds, dry_run=False, update_panel=True):
+    frames = {}
+    for compId in listOfIds:
+        if os.path.exists(".\\omxHelAnalysis\\" + str(compId) + ".pickle"):
+            frames[compId] = load_company_data_pickle(compId)
+    cleanedFrames, changes = clean_frames(frames)
+    changedIds = set(changes["Company ID"])
+    for compId in frames.keys():
+        if not all(check_column_dtype(frames[compId], col) == np.dtype("float64") for col in frames[compId].columns):
+            changedIds.add(compId)
+    changedFrames = {compId: cleanedFrames[compId] for compId in changedIds}
+    if not dry_run:
+        for compId, df in changedFrames.items():
+            save_df_to_pickle(compId, df)
+        if update_panel and changedFrames:
+            upsert_panel(changedFrames)
+    print("Cleaned " + str(len(changedFrames)) + " of " + str(len(frames)) + " df:s, " + str(len(changes)) + " cells changed")
+    return changes
+
+# ________________________________________________________
+### FINANCIAL FILTERS:
+
+# Every criterion is evaluated once by evaluate_X, which returns the verdict and the values behind it
+# filter_X returns only the verdict and p_filter_X only the values
+# The evaluations only read from the df, pass it through normalize_company_frame once when loading
+# Missing data fails a criterion the same way in the panel filters: a column without values counts as missing,
+# its metrics are NaN and the criteria that need it fail
+CriterionResult = collections.namedtuple("CriterionResult", ["passed", "values"])
+
+# Sort latest year first, add the missing panel columns as NaN, convert to float64 and make the values read-only
+def normalize_company_frame(df):
+    df = df.sort_index(ascending=False)
+    df = df.reindex(columns=list(df.columns) + [col for col in panelColumns if col not in df.columns])
+    values = df.apply(pd.to_numeric, errors="coerce").to_numpy(dtype="float64", copy=True)
+    values.flags.writeable = False
+    return pd.DataFrame(values, index=df.index, columns=df.columns, copy=False)
+
+def is_normalized(df):
+    return df.index.is_monotonic_decreasing and set(panelColumns).issubset(df.columns) and all(dtype == np.dtype("float64") for dtype in df.dtypes)
+
+# Column values of a normalized df as a numpy view
+def column_values(df, column):
+    return df[column].to_numpy()
+
+def drop_nan(values):
+    return values[~np.isnan(values)]
+
+# Latest value of a column that is not NaN, NaN when there is none
+def latest_value(df, column):
+    if column not in df.columns:
+        return np.nan
+    values = drop_nan(column_values(df, column))
+    return values[0] if len(values) > 0 else np.nan
+
+# 1. Adequate Size of the Enterprise
+def evaluate_adequate_size(df):
+    if not is_normalized(df):
+        df = normalize_company_frame(df)
+    turnoverLimit = 100 # 100 million €
+    turnover = column_values(df, "Turnover")[1] if len(df.index) > 1 else np.nan
+    return CriterionResult(turnover > turnoverLimit, {"turnover": turnover})
+
+def filter_adequate_size(df):
+    return evaluate_adequate_size(df).passed
+
+def p_filter_adequate_size(df):
+    return evaluate_adequate_size(df).values["turnover"]
+
+# 2. Sufficiently Strong Financial Condition
+def evaluate_financial_condition(df):
+    if not is_normalized(df):
+        df = normalize_company_frame(df)
+    currentRatioLimit = 2   # current assets at least twice the current liabilities
+    ncaLimit = 0            # positive working capital
+    currentRatio = latest_value(df, "Current Ratio")
+    netCurrentAssets = latest_value(df, "Adj. Net Current Assets")
+    return CriterionResult(currentRatio >= currentRatioLimit and netCurrentAssets > ncaLimit,
+                           {"current ratio": currentRatio, "net current assets": netCurrentAssets})
+
+def filter_financial_condition(df):
+    return evaluate_financial_condition(df).passed
+
+def p_filter_financial_condition(df):
+    values = evaluate_financial_condition(df).values
+    return values["current ratio"], values["net current assets"]
+
+# 3. Earning Stability
+def evaluate_earning_stability(df):
+    if not is_normalized(df):
+        df = normalize_company_frame(df)
+    epsLimit = 0    # some earnings each year
+    eps = drop_nan(column_values(df, "Earnings per Share"))[:10]   # for 10 year or if not enough data than max of data
+    years = len(eps)
+    low = eps.min() if years > 0 else np.nan
+    return CriterionResult(low > epsLimit, {"years": years, "low": low})
+
+def filter_earning_stability(df):
+    return evaluate_earning_stability(df).passed
+
+def p_filter_earning_stability(df):
+    values = evaluate_earning_stability(df).values
+    return values["years"], values["low"]
+
+# 4. Dividend Record
+def evaluate_dividend_record(df):
+    if not is_normalized(df):
+        df = normalize_company_frame(df)
+    divHist = 0  # some dividends payed uninterrupted for past 20 years
+    years = min(len(df.index), 20)   # for 20 years or if not enough data then max of data
+    dividends = drop_nan(column_values(df, "Adj. Dividend")[:years])
+    low = dividends.min() if len(dividends) > 0 else np.nan
+    return CriterionResult(len(dividends) > 0 and not (dividends == divHist).any(), {"years": years, "low": low})
+
+def filter_dividend_record(df):
+    return evaluate_dividend_record(df).passed
+
+def p_filter_dividend_record(df):
+    values = evaluate_dividend_record(df).values
+    return values["years"], values["low"]
+
+# 5. Earnings Growth
+def evaluate_earnings_growth(df):
+    if not is_normalized(df):
+        df = normalize_company_frame(df)
+    eGrowth = 1/3  # earnings growth by 1/3 in last 10 years
+    eps = drop_nan(column_values(df, "Earnings per Share"))
+    years = min(len(eps), 10)   # for 10 years or if not enough data then max of data
+    dfLately = dfEarly = np.nan
+    if years > 6:
+        dfLately = eps[:3].sum() /3
+        dfEarly = eps[len(eps)-3:].sum() /3
+    elif 4 < years < 6:
+        dfLately = eps[:2].sum() /2
+        dfEarly = eps[3:5].sum() /2
+    if dfEarly > 0:
+        growth = dfLately / dfEarly - 1
+    else:
+        growth = -1
+    passed = growth >= eGrowth and dfEarly >= 0 and dfLately >= 0
+    return CriterionResult(passed, {"years": years, "growth": growth, "lately": dfLately, "early": dfEarly})
+
+def filter_earnings_growth(df):
+    return evaluate_earnings_growth(df).passed
+
+def p_filter_earnings_growth(df):
+    values = evaluate_earnings_growth(df).values
+    return values["years"], values["growth"]
+
+# 6. Moderate Price/Earnings Ratio
+def evaluate_moderate_PE_ratio(df, price):
+    if not is_normalized(df):
+        df = normalize_company_frame(df)
+    years = 3
+    PElimit = 15
+    eps = drop_nan(column_values(df, "Earnings per Share"))
+    if len(eps) < years:
+        raise IndexError("less than " + str(years) + " years of earnings")
+    average = eps[:years].sum() / years
+    if average == 0:
+        pe = 0
+    else:
+        pe = price / average
+    return CriterionResult(0 < pe < PElimit, {"years": years, "pe": pe})
+
+def filter_moderate_PE_ratio(df, price):
+    return evaluate_moderate_PE_ratio(df, price).passed
+
+def p_filter_moderate_PE_ratio(df, price):
+    values = evaluate_moderate_PE_ratio(df, price).values
+    return values["years"], values["pe"]
+
+# 7. Moderate Ratio of Price to Assets
+def evaluate_moderate_Price_to_Assets_ratio(df):
+    if not is_normalized(df):
+        df = normalize_company_frame(df)
+    PBlimit = 1.5
+    PExPBlimit = 22.5
+    missing = np.isnan(df.to_numpy())
+    complete = ~missing[:, ~missing.all(axis=0)].any(axis=1)    # years with all columns filled, columns without values left out
+    if not complete.any():
+        return CriterionResult(False, {"pb": np.nan, "pexpb": np.nan})
+    latest = complete.argmax()
+    PB = column_values(df, "P/B")[latest]
+    PExPB = column_values(df, "P/E")[latest] * PB
+    return CriterionResult(bool(PB <= PBlimit and PExPB <= PExPBlimit), {"pb": PB, "pexpb": PExPB})
+
+def filter_moderate_Price_to_Assets_ratio(df):
+    return evaluate_moderate_Price_to_Assets_ratio(df).passed
+
+def p_filter_moderate_Price_to_Assets_ratio(df):
+    values = evaluate_moderate_Price_to_Assets_ratio(df).values
+    return values["pb"], values["pexpb"]
+
+# Evaluate all criteria for one company df {criterion: CriterionResult}
+def evaluate_criteria(df, price=None):
+    if price is None:
+        price = np.nan
+    if not is_normalized(df):
+        df = normalize_company_frame(df)
+    results = {}
+    results["Adequate Size"] = evaluate_adequate_size(df)
+    results["Financial Condition"] = evaluate_financial_condition(df)
+    results["Earnings Stability"] = evaluate_earning_stability(df)
+    results["Dividend Record"] = evaluate_dividend_record(df)
+    results["Earnings Growth"] = evaluate_earnings_growth(df)
+    try:
+        results["Moderate P/E Ratio"] = evaluate_moderate_PE_ratio(df, price)
+    except IndexError:  # less than 3 years of earnings
+        results["Moderate P/E Ratio"] = CriterionResult(False, {"years": 3, "pe": np.nan})
+    results["Moderate Price to Assets"] = evaluate_moderate_Price_to_Assets_ratio(df)
+    return results
+
+# ________________________________________________________
+### PANEL FILTERS:
+
+# Thresholds of the filters above, the spans are in years
+defaultThresholds = {"turnoverLimit": 100, "currentRatioLimit": 2, "stabilityYears": 10, "dividendYears": 20, "eGrowth": 1/3,
+                     "peYears": 3, "PElimit": 15, "PBlimit": 1.5, "PExPBlimit": 22.5}
+spanThresholds = ["stabilityYears", "dividendYears", "peYears"]     # these change the metrics, the others only the limits
+
+# Metrics returned by screen_panel, compute_panel_metrics also has the columns that the filters need besides them
+metricColumns = ["Turnover", "Current Ratio", "Net Current Assets", "Stability Years", "Lowest EPS", "Dividend Years", "Lowest Dividend", "Growth Years",
+                 "Earnings Growth", "Average EPS", "P/E (3 year EPS)", "P/B", "P/E x P/B"]
+
+# The metrics behind each criterion {criterion: [metric]}
+criterionMetrics = {"Adequate Size": ["Turnover"], "Financial Condition": ["Current Ratio", "Net Current Assets"],
+                    "Earnings Stability": ["Stability Years", "Lowest EPS"], "Dividend Record": ["Dividend Years", "Lowest Dividend"],
+                    "Earnings Growth": ["Growth Years", "Earnings Growth"], "Moderate P/E Ratio": ["Average EPS", "P/E (3 year EPS)"],
+                    "Moderate Price to Assets": ["P/B", "P/E x P/B"]}
+
+# Metrics behind the filters for every company of a panel at once (company x metric), for the given spans
+def compute_panel_metrics(panel, prices=None, stabilityYears=10, dividendYears=20, peYears=3):
+    panel = panel.sort_index(level=["Company ID", "Year"], ascending=[True, False])
+    companies = panel.index.get_level_values("Company ID").unique()
+    if prices is None:
+        prices = {}
+    prices = pd.Series(prices, dtype="float64").reindex(companies)
+    byCompany = panel.groupby(level="Company ID", sort=False)
+    position = byCompany.cumcount()     # 0 is the latest year of each company
+    hasColumn = panel.notna().groupby(level="Company ID", sort=False).any().reindex(companies)
+    metrics = pd.DataFrame(index=companies)
+
+    # 1. Adequate Size: turnover of the second latest year
+    turnover = panel["Turnover"][np.array(position == 1)].droplevel("Year")
+    metrics["Turnover"] = turnover.reindex(companies)
+
+    # 2. Sufficiently Strong Financial Condition: latest current ratio and net current assets
+    latest = panel[["Current Ratio", "Adj. Net Current Assets"]].groupby(level="Company ID", sort=False).first().reindex(companies)
+    metrics["Current Ratio"] = latest["Current Ratio"]
+    metrics["Net Current Assets"] = latest["Adj. Net Current Assets"]
+
+    # Earnings per share without missing years, latest first
+    eps = panel["Earnings per Share"].dropna()
+    epsByCompany = eps.groupby(level="Company ID", sort=False)
+    epsPosition = np.array(epsByCompany.cumcount())
+    epsCount = np.array(epsByCompany.transform("size"))
+    epsYears = epsByCompany.size().reindex(companies, fill_value=0)
+
+    # 3. Earning Stability: positive earnings for the last 10 years (NaN and failing without earnings)
+    metrics["Stability Years"] = np.minimum(epsYears, stabilityYears)
+    metrics["Lowest EPS"] = eps[epsPosition < stabilityYears].groupby(level="Company ID", sort=False).min().reindex(companies)
+
+    # 4. Dividend Record: no zero dividends for the last 20 years (failing without dividends in them)
+    dividends = panel["Adj. Dividend"][np.array(position < dividendYears)].dropna()
+    metrics["Dividend Years"] = np.minimum(byCompany.size(), dividendYears)
+    metrics["Lowest Dividend"] = dividends.groupby(level="Company ID", sort=False).min().reindex(companies)
+    metrics["Has Dividend"] = dividends.groupby(level="Company ID", sort=False).size().reindex(companies, fill_value=0) > 0
+    metrics["Zero Dividend Years"] = (dividends == 0).groupby(level="Company ID", sort=False).sum().reindex(companies, fill_value=0)
+
+    # 5. Earnings Growth: average of the latest 3 years against the earliest 3 years (2 and 2 with 5 years of data)
+    longHistory = epsCount > 6
+    fiveYears = epsCount == 5
+    lately = eps[(longHistory & (epsPosition < 3)) | (fiveYears & (epsPosition < 2))]
+    early = eps[(longHistory & (epsPosition >= epsCount - 3)) | (fiveYears & (epsPosition >= 3))]
+    span = pd.Series(np.where(epsYears > 6, 3, np.where(epsYears == 5, 2, np.nan)), index=companies)
+    lately = lately.groupby(level="Company ID", sort=False).sum().reindex(companies) / span
+    early = early.groupby(level="Company ID", sort=False).sum().reindex(companies) / span
+    metrics["Growth Years"] = np.minimum(epsYears, 10)
+    metrics["Earnings Growth"] = (lately / early - 1).where(early > 0, -1)
+    metrics["Early EPS"] = early
+    metrics["Lately EPS"] = lately
+
+    # 6. Moderate Price/Earnings Ratio: price against the average earnings of the last 3 years
+    average = eps[epsPosition < peYears].groupby(level="Company ID", sort=False).sum().reindex(companies) / peYears
+    average = average.where(epsYears >= peYears)
+    metrics["Average EPS"] = average
+    metrics["P/E (3 year EPS)"] = (prices / average).where(average != 0, 0)
+
+    # 7. Moderate Ratio of Price to Assets: P/B and P/E of the latest year with all columns filled
+    # (the columns a company has no values for are left out, without P/B or P/E it fails)
+    present = np.array(hasColumn.reindex(panel.index.get_level_values("Company ID")))
+    complete = panel[np.array((panel.notna() | ~present).all(axis=1))]
+    latest = complete[["P/B", "P/E"]].groupby(level="Company ID", sort=False).head(1).droplevel("Year").reindex(companies)
+    metrics["P/B"] = latest["P/B"]
+    metrics["P/E x P/B"] = latest["P/E"] * latest["P/B"]
+    return metrics
+
+# Pass or fail of each criterion from the metrics {criterion: bool array (combination x company)}
+# The limits can be scalars or arrays with one value per combination, they are broadcast over the companies
+def threshold_passes(metrics, thresholds):
+    limits = {}
+    for key, value in thresholds.items():
+        limits[key] = np.asarray(value, dtype="float64").reshape(-1, 1)
+    column = lambda name: metrics[name].to_numpy(dtype="float64").reshape(1, -1)
+    count = max(len(limit) for limit in limits.values())
+    passes = {}
+    passes["Adequate Size"] = column("Turnover") > limits["turnoverLimit"]
+    passes["Financial Condition"] = (column("Current Ratio") >= limits["currentRatioLimit"]) & (column("Net Current Assets") > 0)
+    passes["Earnings Stability"] = column("Lowest EPS") > 0
+    passes["Dividend Record"] = (column("Has Dividend") == 1) & (column("Zero Dividend Years") == 0)
+    passes["Earnings Growth"] = (column("Earnings Growth") >= limits["eGrowth"]) & (column("Early EPS") >= 0) & (column("Lately EPS") >= 0)
+    passes["Moderate P/E Ratio"] = (column("P/E (3 year EPS)") > 0) & (column("P/E (3 year EPS)") < limits["PElimit"])
+    passes["Moderate Price to Assets"] = (column("P/B") <= limits["PBlimit"]) & (column("P/E x P/B") <= limits["PExPBlimit"])
+    for criterion in passes.keys():
+        passes[criterion] = np.broadcast_to(passes[criterion], (count, len(metrics)))
+    return passes
+
+# Evaluates the filters above for every company of a panel at once
+# Returns a boolean pass matrix (company x criterion) and the metrics behind it (company x metric)
+# thresholds can replace any of defaultThresholds
+def screen_panel(panel, prices=None, thresholds=None):
+    thresholds = dict(defaultThresholds, **(thresholds or {}))
+    spans = {key: thresholds[key] for key in spanThresholds}
+    metrics = compute_panel_metrics(panel, prices, **spans)
+    passes = threshold_passes(metrics, thresholds)
+    passMatrix = pd.DataFrame({criterion: passed[0] for criterion, passed in passes.items()}, index=metrics.index)
+    return passMatrix, metrics[metricColumns].copy()
+
+# ________________________________________________________
+### EXTENDED METRICS:
+
+# Valuation metrics besides the filters, computed for the whole panel in one batch
+# screen_companies joins them to the filter metrics so that the filters and the reports share one computation,
+# the average EPS of the P/E years (3 by default) is the "Average EPS" of the filter metrics
+assetsUnit = 1e6    # the financials are in millions of euros, EPS, prices and share counts in euros and shares
+valuationColumns = ["Market Cap", "Enterprise Value", "EV to Turnover", "Turnover per Share", "NCAV per Share", "Price to NCAV"]
+extendedColumns = ["Average EPS (10 year)", "Book Value per Share", "Graham Number",
+                   "Price to Graham Number", "Dividend Yield"] + valuationColumns + ["Net-Net"]
+
+# Market cap, enterprise value and per share values of all companies at once from prices and share counts {compId: value}
+# There is no debt data, the enterprise value is the market cap less the net current assets of the latest year
+def compute_valuation(panel, prices=None, shares=None):
+    companies = panel.index.get_level_values("Company ID").unique()
+    if prices is None:
+        prices = {}
+    if shares is None:
+        shares = {}
+    prices = pd.Series(prices, dtype="float64").reindex(companies)
+    shares = pd.Series(shares, dtype="float64").reindex(companies)
+    latest = panel.sort_index(level=["Company ID", "Year"], ascending=[True, False]) \
+        .groupby(level="Company ID", sort=False)[["Turnover", "Adj. Net Current Assets"]].first().reindex(companies) * assetsUnit
+    valuation = pd.DataFrame(index=companies)
+    valuation["Market Cap"] = prices * shares
+    valuation["Enterprise Value"] = valuation["Market Cap"] - latest["Adj. Net Current Assets"]
+    valuation["EV to Turnover"] = (valuation["Enterprise Value"] / latest["Turnover"]).where(latest["Turnover"] > 0)
+    valuation["Turnover per Share"] = latest["Turnover"] / shares
+    valuation["NCAV per Share"] = latest["Adj. Net Current Assets"] / shares
+    valuation["Price to NCAV"] = (prices / valuation["NCAV per Share"]).where(valuation["NCAV per Share"] > 0)
+    return valuation
+
+# prices and shares {compId: value}, the market cap and net-net metrics are NaN without share counts
+def compute_extended_metrics(panel, prices=None, shares=None):
+    panel = panel.sort_index(level=["Company ID", "Year"], ascending=[True, False])
+    companies = panel.index.get_level_values("Company ID").unique()
+    if prices is None:
+        prices = {}
+    prices = pd.Series(prices, dtype="float64").reindex(companies)
+    latest = panel.groupby(level="Company ID", sort=False).first().reindex(companies)     # latest value of each column
+    metrics = pd.DataFrame(index=companies)
+
+    # Averaged EPS of up to the last 10 years with earnings
+    eps = panel["Earnings per Share"].dropna()
+    metrics["Average EPS (10 year)"] = eps.groupby(level="Company ID", sort=False).head(10).groupby(level="Company ID", sort=False).mean().reindex(companies)
+
+    # Graham number sqrt(22.5 x EPS x book value per share) of the latest year with P/E, P/B and EPS,
+    # the book value is the year end price (P/E x EPS) / P/B
+    complete = panel[["P/E", "P/B", "Earnings per Share"]].dropna()
+    book = complete.groupby(level="Company ID", sort=False).head(1).droplevel("Year").reindex(companies)
+    metrics["Book Value per Share"] = (book["P/E"] * book["Earnings per Share"] / book["P/B"]).where(book["P/B"] > 0)
+    product = 22.5 * book["Earnings per Share"] * metrics["Book Value per Share"]
+    metrics["Graham Number"] = np.sqrt(product.where((book["Earnings per Share"] > 0) & (metrics["Book Value per Share"] > 0)))
+    metrics["Price to Graham Number"] = prices / metrics["Graham Number"]
+
+    metrics["Dividend Yield"] = latest["Adj. Dividend"] / prices
+
+    # Net-net: price under 2/3 of the net current assets per share, unknown (NA) without a price or a share count
+    metrics = metrics.join(compute_valuation(panel, prices, shares))
+    netNet = (metrics["Price to NCAV"] < 2/3).astype("boolean")
+    metrics["Net-Net"] = netNet.mask(prices.isna() | metrics["NCAV per Share"].isna())
+    return metrics
+
+# ________________________________________________________
+### THRESHOLD SWEEP:
+
+# Pass counts and selected companies for every combination of threshold grids {threshold: [values]}
+# The metrics are computed once per combination of spans, the limits are broadcast over them all at once
+# With processes the combinations are split into chunks of chunk_size (default: about 4 chunks per process)
+# within their span groups and the chunks are spread over a process pool
+
+# Rows of the sweep for one span combination: combinations is a data frame with one column per threshold
+def sweep_span(metrics, combinations, min_criteria=None):
+    passes = threshold_passes(metrics, {key: combinations[key].to_numpy() for key in combinations.columns})
+    scores = sum(passed.astype("int64") for passed in passes.values())
+    if min_criteria is None:
+        min_criteria = len(passes)
+    selected = scores >= min_criteria
+    rows = combinations.copy()
+    for criterion, passed in passes.items():
+        rows[criterion + " qty"] = passed.sum(axis=1)
+    rows["Selected qty"] = selected.sum(axis=1)
+    companies = np.array(metrics.index)
+    rows["Selected"] = [tuple(companies[mask]) for mask in selected]
+    return rows
+
+def sweep_thresholds(panel, grid, prices=None, min_criteria=None, processes=None, chunk_size=None):
+    thresholds = dict(defaultThresholds)
+    for key in grid.keys():
+        if key not in thresholds:
+            raise KeyError("unknown threshold: " + str(key))
+        thresholds[key] = list(grid[key])
+    for key in thresholds.keys():
+        if not isinstance(thresholds[key], list):
+            thresholds[key] = [thresholds[key]]
+    combinations = pd.MultiIndex.from_product(list(thresholds.values()), names=list(thresholds.keys())).to_frame(index=False)
+    groups = list(combinations.groupby(spanThresholds, sort=False))
+    if chunk_size is None:
+        chunk_size = -(-len(combinations) // (processes * 4)) if processes else len(combinations)
+    jobs = []
+    for spans, group in groups:
+        metrics = compute_panel_metrics(panel, prices, **dict(zip(spanThresholds, spans)))
+        for start in range(0, len(group), chunk_size):
+            jobs.append((metrics, group.iloc[start:start + chunk_size]))
+    if processes:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(sweep_span, [job[0] for job in jobs], [job[1] for job in jobs], [min_criteria] * len(jobs)))
+    else:
+        results = [sweep_span(metrics, group, min_criteria) for metrics, group in jobs]
+    return pd.concat(results).sort_index().reset_index(drop=True)
+
+# ________________________________________________________
+### BACKTEST:
+
+# Runs the panel filters as of the end of each past year on the data known then, all years in one screen_panel call,
+# and measures the forward returns of the selected companies
+# The annual results of a year come out in the spring after it (reportingMonth), so the screen as of year Y uses
+# the results up to Y-1 against the price at the end of Y
+# There are no stored price histories, year end prices are implied by P/E x EPS of the same year
+
+def implied_prices(panel):
+    price = panel["P/E"] * panel["Earnings per Share"]
+    return price.where(price > 0)
+
+# The panel as it was known at the end of each year (results up to the year before) stacked into one panel,
+# its companies are "year:compId"
+def as_of_panel(panel, years):
+    yearLevel = panel.index.get_level_values("Year")
+    parts = {}
+    for year in years:
+        parts[year] = panel[np.array(yearLevel < year)]
+    stacked = pd.concat(parts, names=["As Of"])
+    keys = stacked.index.get_level_values("As Of").astype(str) + ":" + stacked.index.get_level_values("Company ID").astype(str)
+    stacked.index = pd.MultiIndex.from_arrays([keys, stacked.index.get_level_values("Year")], names=["Company ID", "Year"])
+    return stacked
+
+# "year:compId" keys back to an (As Of, Company ID) index
+def split_as_of(keys):
+    parts = pd.Series(keys, dtype=object).str.split(":", n=1, expand=True)
+    return pd.MultiIndex.from_arrays([parts[0].astype("int64"), parts[1]], names=["As Of", "Company ID"])
+
+# Years of the panel that have results before them, the first year has none
+def backtest_years(panel):
+    return sorted(panel.index.get_level_values("Year").unique())[1:]
+
+# Pass matrix and metrics indexed by (As Of, Company ID), screened with the implied price of each as-of year
+# thresholds can replace any of defaultThresholds as in screen_panel
+def screen_as_of(panel, years=None, thresholds=None):
+    if years is None:
+        years = backtest_years(panel)
+    prices = implied_prices(panel)
+    priceKeys = prices.index.get_level_values("Year").astype(str) + ":" + prices.index.get_level_values("Company ID").astype(str)
+    passMatrix, metrics = screen_panel(as_of_panel(panel, years), pd.Series(prices.to_numpy(), index=priceKeys), thresholds)
+    passMatrix.index = split_as_of(passMatrix.index)
+    metrics.index = split_as_of(metrics.index)
+    return passMatrix, metrics
+
+# Return from the end of each year over the next horizon years, with the dividends paid meanwhile
+# indexed by (As Of, Company ID)
+def forward_returns(panel, horizon=1):
+    price = implied_prices(panel).unstack("Year")
+    years = price.columns
+    dividends = panel["Adj. Dividend"].unstack("Year").fillna(0)
+    future = price.reindex(columns=years + horizon)
+    future.columns = years
+    paid = pd.DataFrame(0.0, index=price.index, columns=years)
+    for k in range(1, horizon + 1):
+        paid += dividends.reindex(index=price.index, columns=years + k, fill_value=0).to_numpy()
+    returns = ((future + paid) / price - 1).stack()
+    returns.index = returns.index.set_names(["Company ID", "As Of"])
+    return returns.swaplevel().sort_index()
+
+# Backtest of the screen: companies passing all criteria (or at least min_criteria) as of each year
+# Returns (summary per as-of year, the selected companies with their metrics and forward return)
+# Without any as-of year that has earlier results (e.g. an empty panel) both are empty
+def backtest(panel, years=None, horizon=1, min_criteria=None, thresholds=None):
+    if years is None:
+        years = backtest_years(panel)
+    yearLevel = panel.index.get_level_values("Year")
+    if not any((yearLevel < year).any() for year in years):
+        print("No years with earlier results to backtest, the panel store has " + str(yearLevel.nunique()) + " years")
+        summary = pd.DataFrame(columns=["Companies", "Selected", "Selection Return", "Universe Return", "Excess Return"],
+                               index=pd.Index([], dtype="int64", name="As Of"), dtype="float64")
+        selections = pd.DataFrame(index=pd.MultiIndex.from_arrays([pd.Index([], dtype="int64"), pd.Index([], dtype=object)],
+                                                                  names=["As Of", "Company ID"]))
+        return summary, selections
+    passMatrix, metrics = screen_as_of(panel, years, thresholds)
+    returns = forward_returns(panel, horizon).reindex(passMatrix.index)
+    if min_criteria is None:
+        min_criteria = len(passMatrix.columns)
+    selected = np.array(passMatrix.sum(axis=1) >= min_criteria)
+    asOf = passMatrix.index.get_level_values("As Of")
+    summary = pd.DataFrame({
+        "Companies": pd.Series(1, index=asOf).groupby(level=0).sum(),
+        "Selected": pd.Series(selected.astype(int), index=asOf).groupby(level=0).sum(),
+        "Selection Return": pd.Series(returns.to_numpy()[selected], index=asOf[selected], dtype="float64").groupby(level=0).mean(),
+        "Universe Return": pd.Series(returns.to_numpy(), index=asOf).groupby(level=0).mean()})
+    summary["Excess Return"] = summary["Selection Return"] - summary["Universe Return"]
+    summary.index.name = "As Of"
+    selections = passMatrix[selected].add_suffix(" Passed").join(metrics[selected])
+    selections["Forward Return"] = returns[selected]
+    return summary, selections
+
+# ________________________________________________________
+### COMBINING FILTERS:
+
+# Which companies pass which criteria as a boolean matrix (company x criterion)
+# All queries are column selections and row reductions on the matrix, no list scanning
+class PassMatrix:
+    def __init__(self, passMatrix):
+        self.companies = passMatrix.index
+        self.criteria = list(passMatrix.columns)
+        self.values = passMatrix.to_numpy(dtype=bool)
+
+    # Build from per criterion lists of passing companies {criterion: [company]}
+    @classmethod
+    def from_lists(cls, companies, passLists):
+        companies = pd.Index(companies)
+        passMatrix = pd.DataFrame(index=companies)
+        for criterion, passed in passLists.items():
+            passMatrix[criterion] = companies.isin(passed)
+        return cls(passMatrix)
+
+    def select(self, criteria=None):
+        if criteria is None:
+            return self.values
+        return self.values[:, [self.criteria.index(criterion) for criterion in criteria]]
+
+    # Companies passing every given criterion (all criteria by default)
+    def all_of(self, criteria=None):
+        return list(self.companies[self.select(criteria).all(axis=1)])
+
+    # Companies passing any of the given criteria
+    def any_of(self, criteria=None):
+        return list(self.companies[self.select(criteria).any(axis=1)])
+
+    # Companies passing at least k of the given criteria
+    def at_least(self, k, criteria=None):
+        return list(self.companies[self.select(criteria).sum(axis=1) >= k])
+
+    def passed(self, criterion):
+        return self.all_of([criterion])
+
+    # Number of passing companies per criterion
+    def counts(self):
+        return dict(zip(self.criteria, self.values.sum(axis=0).tolist()))
+
+    # Number of criteria passed per company
+    def scores(self):
+        return pd.Series(self.values.sum(axis=1), index=self.companies)
+
+    def to_frame(self):
+        return pd.DataFrame(self.values, index=self.companies, columns=self.criteria)
+
+# ________________________________________________________
+### SCREENING SESSION:
+
+# Loads and normalizes each company df once per screening run, from the pickles or from a loaded panel
+# The cached dfs are read-only and shared between all filter evaluations
+class ScreeningSession:
+    def __init__(self, panel=None):
+        self.panel = panel
+        self.cache = {}     # {compId: df}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, company_id):
+        if company_id in self.cache:
+            self.hits += 1
+        else:
+            self.misses += 1
+            if self.panel is not None:
+                df = get_company_frame(self.panel, company_id)
+            else:
+                df = load_company_data_pickle(company_id)
+            self.cache[company_id] = normalize_company_frame(df)
+        return self.cache[company_id]
+
+    def stats(self):
+        return {"companies": len(self.cache), "hits": self.hits, "misses": self.misses}
+
+# ________________________________________________________
+### WATCH MODE:
+
+priceCriteria = ["Moderate P/E Ratio"]  # the criteria that change with the price
+
+# Keeps the price independent part of the screen in memory (the other criteria and the average EPS)
+# New prices re-evaluate only the P/E criterion of the companies whose price moved
+# and give enter and leave events of the set of companies passing all criteria
+class ScreenWatcher:
+    def __init__(self, panel, tickers, prices=None, names=None, thresholds=None):
+        # tickers {compId: ticker}, prices {compId: price}, names {compId: compName}
+        self.thresholds = dict(defaultThresholds, **(thresholds or {}))
+        metrics = compute_panel_metrics(panel, None, **{key: self.thresholds[key] for key in spanThresholds})
+        passes = threshold_passes(metrics, self.thresholds)
+        self.companies = metrics.index
+        self.names = names or {}
+        self.averageEps = metrics["Average EPS"].to_numpy(dtype="float64")
+        self.fundamentals = np.logical_and.reduce([passed[0] for criterion, passed in passes.items() if criterion not in priceCriteria])
+        self.tickers = {}   # {ticker: [compId]}
+        for compId, ticker in tickers.items():
+            self.tickers.setdefault(ticker, []).append(compId)
+        self.prices = np.full(len(self.companies), np.nan)
+        self.passing = np.zeros(len(self.companies), dtype=bool)
+        self.evaluations = 0
+        self.polls = 0
+        if prices:
+            self.update_companies(prices, emit=False)
+
+    # P/E against the average EPS as in compute_panel_metrics and whether it passes
+    def price_passes(self, prices, averageEps):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pe = np.where(averageEps == 0, 0, prices / averageEps)
+        return pe, (pe > 0) & (pe < self.thresholds["PElimit"])
+
+    # New prices {compId: price}, returns the enter and leave events
+    def update_companies(self, prices, emit=True):
+        new = pd.Series(prices, dtype="float64").reindex(self.companies).to_numpy()
+        moved = np.flatnonzero(~np.isnan(new) & (new != self.prices))
+        self.prices[moved] = new[moved]
+        pe, pePassed = self.price_passes(new[moved], self.averageEps[moved])
+        passing = self.fundamentals[moved] & pePassed
+        changed = passing != self.passing[moved]
+        self.passing[moved] = passing
+        self.evaluations += len(moved)
+        events = []
+        if emit:
+            for i in np.flatnonzero(changed):
+                compId = self.companies[moved[i]]
+                events.append({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "event": "enter" if passing[i] else "leave",
+                               "Company": self.names.get(compId, compId), "Company ID": compId,
+                               "Price": float(new[moved[i]]), "P/E": float(pe[i])})
+        return events
+
+    # New prices {ticker: price}
+    def update(self, tickerPrices):
+        prices = {}
+        for ticker, price in tickerPrices.items():
+            for compId in self.tickers.get(ticker, []):
+                prices[compId] = price
+        return self.update_companies(prices)
+
+    # Download the latest prices of all tickers, returns the events
+    def poll(self):
+        self.polls += 1
+        return self.update(get_last_prices(list(self.tickers.keys()), max_age=0).to_dict())
+
+    # Poll every interval seconds (iterations times, or until interrupted) and pass each event to callback
+    def watch(self, interval=60, iterations=None, callback=print):
+        polled = 0
+        try:
+            while iterations is None or polled < iterations:
+                start = time.monotonic()
+                for event in self.poll():
+                    callback(event)
+                polled += 1
+                if iterations is None or polled < iterations:
+                    time.sleep(max(0, interval - (time.monotonic() - start)))
+        except KeyboardInterrupt:
+            pass
+
+    def passing_companies(self):
+        return [self.names.get(compId, compId) for compId in self.companies[self.passing]]
+
+    def stats(self):
+        return {"companies": len(self.companies), "passing": int(self.passing.sum()), "polls": self.polls,
+                "re-evaluations": self.evaluations}
+
+# ________________________________________________________
+### RUNTIME STATE:
+
+# Runtime variables kept in the omxHelVariable shelve {attribute: shelve key}
+stateKeys = {"compDict": "dict", "errorsList": "errorsList", "compTickers": "compTickers",
+             "priceDict": "priceDict", "compTickersDict": "compTickersDict", "unmatchedTickers": "unmatchedTickers"}
+stateDefaults = {"unmatchedTickers": [], "compTickers": None}    # used while the shelve has no value
+
+# Companies that can not be screened {compId: reason}: no df, a df with problems (schema index)
+# or a name that the ticker matching left unmatched
+def excluded_companies(compDict, unmatchedTickers=()):
+    problems = index_problems(list(compDict.values()))
+    excluded = {}
+    for compName, compId in compDict.items():
+        if problems[compId]:
+            excluded[compId] = ", ".join(problems[compId])
+        elif compName in unmatchedTickers:
+            excluded[compId] = "no ticker"
+    return excluded
+
+# Companies with a df, without the ones known to have unusable data
+def working_id_list(compDict, unmatchedTickers=()):
+    excluded = excluded_companies(compDict, unmatchedTickers)
+    workingIdList = []
+    for compId in compDict.values():
+        if compId not in excluded:
+            workingIdList.append(compId)
+    return workingIdList
+
+# The runtime variables, each one is read from the shelve (or worked out) on first use
+# Assigning one of the shelve variables also saves it to the shelve
+class RuntimeState:
+    def __init__(self, location="omxHelVariable"):
+        object.__setattr__(self, "location", location)
+        object.__setattr__(self, "shelf", None)
+
+    def open(self):
+        if self.shelf is None:
+            object.__setattr__(self, "shelf", shelve.open(self.location))
+        return self.shelf
+
+    def __getattr__(self, name):
+        if name in stateKeys and name in stateDefaults:
+            value = self.open().get(stateKeys[name], stateDefaults[name])
+        elif name in stateKeys:
+            value = self.open()[stateKeys[name]]
+        elif name == "workingIdList":
+            value = working_id_list(self.compDict, self.unmatchedTickers)
+        else:
+            raise AttributeError(name)
+        object.__setattr__(self, name, value)
+        return value
+
+    def __setattr__(self, name, value):
+        if name in stateKeys:
+            self.open()[stateKeys[name]] = value
+        object.__setattr__(self, name, value)
+
+    def close(self):
+        if self.shelf is not None:
+            self.shelf.close()
+            object.__setattr__(self, "shelf", None)
+
+# The panel of the working companies, imported from the pickles when the panel store does not have them all
+def load_working_panel(state):
+    panel = load_panel()
+    if not set(state.workingIdList).issubset(panel.index.get_level_values("Company ID")):
+        panel = import_pickles_to_panel(state.workingIdList)
+    panel = panel[panel.index.get_level_values("Company ID").isin(state.workingIdList)]
+    return panel
+
+# priceDict by company ID {compId: price}
+def company_prices(state):
+    prices = {}     # {compId: price}
+    for comp in state.priceDict.keys():
+        if comp in state.compDict:
+            prices[state.compDict[comp]] = state.priceDict[comp]
+    return prices
+
+# Company names by company ID {compId: compName}
+def company_names(state):
+    names = {}
+    for comp in state.compDict.keys():
+        names[state.compDict[comp]] = comp
+    return names
+
+# Screen the working companies from the panel store, import the pickles if the store is incomplete
+# Returns (PassMatrix and metrics with the extended metrics indexed by company name, the screening session over the panel)
+def screen_companies(state, thresholds=None):
+    panel = load_working_panel(state)
+    session = ScreeningSession(panel)
+    prices = company_prices(state)
+    passMatrix, metrics = screen_panel(panel, prices, thresholds)
+    metrics = metrics.join(compute_extended_metrics(panel, prices, read_share_counts(state.workingIdList)))
+    compNames = company_names(state)
+    return PassMatrix(passMatrix.rename(index=compNames)), metrics.rename(index=compNames), session
+
+# ________________________________________________________
+### COMMAND LINE:
+
+# Non-interactive subcommands for scheduled runs, results go to stdout (or --output) as json or csv
+# Progress messages are printed to stderr so that the output can be piped on
+# Every command returns (exit status, data frame of results)
+
+def write_output(frame, output_format="json", output=None):
+    frame = frame.reset_index()
+    if output_format == "csv":
+        text = frame.to_csv(index=False)
+    else:
+        text = json.dumps(json.loads(frame.to_json(orient="records")), indent=2, ensure_ascii=False) + "\n"
+    if output is None or output == "-":
+        sys.stdout.write(text)
+    else:
+        with open(output, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+
+def report_frame(report):
+    rows = []
+    for compId in report.keys():
+        rows.append({"Company ID": compId, "ok": report[compId]["ok"], "unchanged": report[compId].get("unchanged", False),
+                     "attempts": report[compId]["attempts"], "seconds": report[compId]["seconds"],
+                     "error": report[compId]["error"], "problems": "; ".join(report[compId].get("problems", []))})
+    return pd.DataFrame(rows, columns=["Company ID", "ok", "unchanged", "attempts", "seconds", "error", "problems"]).set_index("Company ID")
+
+def command_refresh(state, args):
+    listOfIds = args.ids or list(state.compDict.values())
+    options = {"fetch_workers": args.workers, "parse_workers": args.parse_workers, "per_host_rate": args.rate,
+               "retries": args.retries, "backoff": args.backoff, "share_counts": not args.no_shares}
+    if args.all:
+        report = run_ingest_pipeline(listOfIds, skip_unchanged=not args.force, **options)
+    else:
+        needing, report = incremental_refresh(listOfIds, ttl_days=args.ttl_days, **options)
+        print(str(len(needing)) + " of " + str(len(listOfIds)) + " companies refreshed")
+    state.errorsList = merge_flagged_companies(state.errorsList, report)
+    print_refresh_report(report)
+    if httpCache is not None:
+        print("Http cache: " + str(httpCache.stats()))
+    print("Http client: " + str(httpClient.stats()))
+    frame = report_frame(report)
+    return int(not frame["ok"].all()), frame
+
+# List the problems of every company df from the schema index, with --save-errors the companies with problems become the errorsList
+# With --coverage the year coverage, NaN counts and fetch times of every company are listed instead
+def command_validate(state, args):
+    if args.coverage:
+        frame = schema_index_frame(list(state.compDict.values()))
+        frame.insert(0, "Company", list(state.compDict.keys()))
+        return 0, frame
+    problems = index_problems(list(state.compDict.values()))
+    rows = []
+    for compName, compId in state.compDict.items():
+        for problem in problems[compId]:
+            rows.append({"Company": compName, "Company ID": compId, "Problem": problem})
+    frame = pd.DataFrame(rows, columns=["Company", "Company ID", "Problem"]).set_index("Company")
+    if args.save_errors:
+        state.errorsList = list(set(frame["Company ID"][frame["Problem"] != "no data frame"]))
+    return int(len(frame) > 0), frame
+
+# The repairs of the error checking prompts, applied in the order given
+repairMethods = {"coerce": convert_error_to_NaN_coerce, "dash": convert_line_to_empty, "numeric": convert_pickled_df_to_numeric}
+
+# Repair the companies on the errorsList (or --ids), then validate them again
+def command_repair(state, args):
+    listOfIds = args.ids or list(state.errorsList)
+    if args.refetch:
+        print_refresh_report(refresh_company_pickles(listOfIds, max_workers=args.workers, per_host_rate=args.rate,
+                                                     retries=args.retries, backoff=args.backoff, update_panel=False))
+    repairedFrames = {}
+    rows = []
+    for compId in listOfIds:
+        if not os.path.exists(".\\omxHelAnalysis\\" + str(compId) + ".pickle"):
+            rows.append({"Company ID": compId, "Problem": "no data frame"})
+            continue
+        for method in args.method or []:
+            save_df_to_pickle(compId, repairMethods[method](compId))
+        repairedFrames[compId] = load_company_data_pickle(compId)
+        for problem in validate_company_df(repairedFrames[compId]):
+            rows.append({"Company ID": compId, "Problem": problem})
+    if repairedFrames:
+        upsert_panel(repairedFrames)
+    frame = pd.DataFrame(rows, columns=["Company ID", "Problem"]).set_index("Company ID")
+    return int(len(frame) > 0), frame
+
+# Clean the pickles of all companies (or --ids) in one pass, the output lists every changed cell
+def command_clean(state, args):
+    return 0, clean_company_pickles(args.ids or list(state.compDict.values()), dry_run=args.dry_run).set_index("Company ID")
+
+# Update the company registry and compDict, the output lists the registered companies
+def command_discover(state, args):
+    registry, errors = update_company_registry(args.workers, args.refresh_names, args.names_from_listing)
+    dictionary = {}
+    for compId, compName in registry["companies"].items():
+        dictionary[compName] = compId
+    state.compDict = dictionary
+    frame = pd.DataFrame({"Company ID": list(registry["companies"].keys()), "Company": list(registry["companies"].values()),
+                          "Registry Version": registry["version"]}).set_index("Company ID")
+    return int(len(errors) > 0), frame
+
+# Pass counts and selections for every combination of the --grid thresholds
+def command_sweep(state, args):
+    panel = load_working_panel(state)
+    prices = company_prices(state)
+    grid = {}
+    for key, values in args.grid or []:
+        grid[key] = values
+    frame = sweep_thresholds(panel, grid, prices, args.min_criteria, args.processes).rename_axis("Combination")
+    if args.output_format == "csv":
+        frame["Selected"] = frame["Selected"].map(";".join)
+    return 0, frame
+
+# Watch the prices and print an enter or leave event (a json line) whenever a company joins or drops out of
+# the set passing all criteria, the starting prices are those of priceDict
+def command_watch(state, args):
+    panel = load_working_panel(state)
+    tickers = {}    # {compId: ticker}
+    for comp in state.compTickersDict.keys():
+        if comp in state.compDict:
+            tickers[state.compDict[comp]] = state.compTickersDict[comp]
+    if not tickers:
+        print("No tickers to watch, create the company symbol dictionary first")
+        return 1, None
+    watcher = ScreenWatcher(panel, tickers, company_prices(state), company_names(state), dict(args.threshold or []))
+    print("Passing all criteria: " + ", ".join(watcher.passing_companies()))
+    stream = args.stdout if args.output is None or args.output == "-" else open(args.output, "a", encoding="utf-8")
+
+    def emit(event):
+        stream.write(json.dumps(event, ensure_ascii=False) + "\n")
+        stream.flush()
+
+    try:
+        watcher.watch(args.interval, args.iterations, emit)
+    finally:
+        if stream is not args.stdout:
+            stream.close()
+    print("Watcher: " + str(watcher.stats()))
+    return 0, None
+
+# Backtest the screen as of each year in the panel store, the output is the summary per year (or the selections)
+def command_backtest(state, args):
+    panel = load_working_panel(state)
+    summary, selections = backtest(panel, args.years, args.horizon, args.min_criteria, dict(args.threshold or []))
+    print(summary.to_string())
+    if args.selections:
+        return 0, selections
+    return 0, summary
+
+# Match the company names to the tickers of the Nasdaq listing, the output has the symbol and the match of every company
+def command_tickers(state, args):
+    if args.update or state.compTickers is None:
+        state.compTickers = get_company_tickers()
+    matcher = TickerMatcher(state.compTickers, args.cutoff)
+    state.compTickersDict, state.unmatchedTickers = matcher.match_all(state.compDict.keys())
+    print("Unmatched company names: " + ", ".join(state.unmatchedTickers))
+    return int(len(state.unmatchedTickers) > 0), matcher.report(state.compDict.keys())
+
+# The pass matrix, number of criteria passed and the metrics of every company (or of those passing --min-criteria)
+def command_screen(state, args):
+    if args.update_prices:
+        state.priceDict = get_price_dictionary(state.compTickersDict)
+    matrix, metrics, session = screen_companies(state, dict(args.threshold or []))
+    frame = matrix.to_frame().add_suffix(" Passed")
+    frame.insert(0, "Company ID", [state.compDict[comp] for comp in frame.index])
+    frame["Criteria Passed"] = matrix.scores()
+    frame = frame.join(metrics)
+    frame.index.name = "Company"
+    if args.min_criteria is not None:
+        frame = frame[frame["Criteria Passed"] >= args.min_criteria]
+    for criterion, qty in matrix.counts().items():
+        print(criterion + " qty: " + str(qty))
+    print("All filters combined qty: " + str(len(matrix.all_of())))
+    return 0, frame
+
+# Values behind each criterion for the companies passing all (or --min-criteria) criteria
+# Taken from the pass matrix and the metrics of the screening run, nothing is evaluated again
+def command_report(state, args):
+    matrix, metrics, session = screen_companies(state)
+    if args.min_criteria is None:
+        companies = matrix.all_of()
+    else:
+        companies = matrix.at_least(args.min_criteria)
+    passed = matrix.to_frame().loc[companies]
+    metrics = metrics.loc[companies]
+    frame = pd.DataFrame({"Company ID": [state.compDict[comp] for comp in companies]}, index=pd.Index(companies, name="Company"))
+    for criterion in matrix.criteria:
+        frame[criterion + " Passed"] = passed[criterion]    # as in screen, "Earnings Growth" is also a metric
+        for col in criterionMetrics[criterion]:
+            frame[col] = metrics[col]
+    for col in extendedColumns:
+        frame[col] = metrics[col]
+    return 0, frame
+
+# The benchmarks are in omxHelBenchmarks, with --save-fixtures the pages of the given companies are saved for the tables benchmark
+def command_bench(state, args):
+    import omxHelBenchmarks as benchmarks
+    if args.benchmark == "startup":
+        results = benchmarks.benchmark_startup(args.repeat)
+    elif args.benchmark == "filters":
+        frames = {}
+        for compId in state.workingIdList:
+            frames[compId] = load_company_data_pickle(compId)
+        results = benchmarks.benchmark_filter_allocations(frames, company_prices(state))
+    else:
+        if args.save_fixtures:
+            benchmarks.save_html_fixtures(args.save_fixtures, args.fixtures)
+        htmlFiles = sorted(glob.glob(os.path.join(args.fixtures, "tulostiedot_*.html")))
+        if not htmlFiles:
+            print("No html fixtures in " + args.fixtures + ", save some with --save-fixtures")
+            return 1, None
+        results = benchmarks.benchmark_table_extraction(htmlFiles, args.repeat)
+    frame = pd.json_normalize(results, sep=" ")
+    frame.index.name = "Benchmark"
+    return 0, frame.rename(index={0: args.benchmark})
+
+# "PElimit=15" to ("PElimit", 15.0) and "PElimit=10,15,20" to ("PElimit", [10.0, 15.0, 20.0])
+def threshold_argument(text, many=False):
+    key, sep, values = text.partition("=")
+    if key not in defaultThresholds or sep == "":
+        raise argparse.ArgumentTypeError("expected threshold=value, thresholds: " + ", ".join(defaultThresholds))
+    values = [int(value) if key in spanThresholds else float(value) for value in values.split(",")]
+    if many:
+        return key, values
+    return key, values[0]
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Analyses company data of the Helsinki stock exchange to find cheap stocks. "
+                                                 "Without a command the interactive prompts are run.")
+    parser.add_argument("--state", default="omxHelVariable", help="shelve file of the runtime variables (default: %(default)s)")
+    parser.set_defaults(no_cache=False, revalidate=False, cache_max_mb=None, max_per_host=None)
+
+    httpOptions = argparse.ArgumentParser(add_help=False)
+    httpOptions.add_argument("--no-cache", action="store_true", help="always download, do not use the http cache")
+    httpOptions.add_argument("--revalidate", action="store_true", help="ask the server about every cached response")
+    httpOptions.add_argument("--cache-max-mb", type=float, help="size limit of the http cache in megabytes")
+    httpOptions.add_argument("--max-per-host", type=int, help="requests in flight to one host")
+
+    outputOptions = argparse.ArgumentParser(add_help=False)
+    outputOptions.add_argument("--format", dest="output_format", choices=["json", "csv"], default="json")
+    outputOptions.add_argument("--output", "-o", help="write the results to this file instead of stdout")
+
+    fetchOptions = argparse.ArgumentParser(add_help=False)
+    fetchOptions.add_argument("--ids", nargs="+", help="company ids (default: all companies)")
+    fetchOptions.add_argument("--workers", type=int, default=8, help="concurrent downloads (default: %(default)s)")
+    fetchOptions.add_argument("--rate", type=float, default=4.0, help="requests per second per host (default: %(default)s)")
+    fetchOptions.add_argument("--retries", type=int, default=3)
+    fetchOptions.add_argument("--backoff", type=float, default=1.0, help="seconds before the first retry, doubled on each retry")
+
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    refresh = commands.add_parser("refresh", parents=[outputOptions, fetchOptions, httpOptions], help="update company data from Kauppalehti")
+    refresh.add_argument("--all", action="store_true", help="refetch all companies instead of the stale or incomplete ones")
+    refresh.add_argument("--force", action="store_true", help="with --all, parse the pages even when they have not changed")
+    refresh.add_argument("--parse-workers", type=int, help="parsing processes (default: one per cpu)")
+    refresh.add_argument("--no-shares", action="store_true", help="do not fetch the share counts")
+    refresh.add_argument("--ttl-days", type=float, default=refreshTtlDays, help="refetch data older than this (default: %(default)s)")
+    refresh.set_defaults(run=command_refresh)
+
+    validate = commands.add_parser("validate", parents=[outputOptions], help="list missing and malformed company data")
+    validate.add_argument("--save-errors", action="store_true", help="save the companies with problems as the errorsList")
+    validate.add_argument("--coverage", action="store_true", help="list the columns, years and NaN counts of every company")
+    validate.set_defaults(run=command_validate)
+
+    repair = commands.add_parser("repair", parents=[outputOptions, fetchOptions, httpOptions], help="repair the companies on the errorsList")
+    repair.add_argument("--method", action="append", choices=sorted(repairMethods), help="repair to apply, can be repeated")
+    repair.add_argument("--refetch", action="store_true", help="download the data again before the repairs")
+    repair.set_defaults(run=command_repair)
+
+    clean = commands.add_parser("clean", parents=[outputOptions], help="clean the data of all companies in one pass")
+    clean.add_argument("--ids", nargs="+", help="company ids (default: all companies)")
+    clean.add_argument("--dry-run", action="store_true", help="only list the changes, do not save them")
+    clean.set_defaults(run=command_clean)
+
+    discover = commands.add_parser("discover", parents=[outputOptions, httpOptions], help="update the list of companies")
+    discover.add_argument("--workers", type=int, default=8, help="concurrent downloads (default: %(default)s)")
+    discover.add_argument("--refresh-names", action="store_true", help="download the names of all companies, not only the new ones")
+    discover.add_argument("--names-from-listing", action="store_true", help="take the names from the links of the listing page")
+    discover.set_defaults(run=command_discover)
+
+    tickers = commands.add_parser("tickers", parents=[outputOptions, httpOptions], help="match the company names to tickers")
+    tickers.add_argument("--update", action="store_true", help="download the Nasdaq listing again")
+    tickers.add_argument("--cutoff", type=float, default=0.85, help="similarity needed for a fuzzy match (default: %(default)s)")
+    tickers.set_defaults(run=command_tickers)
+
+    screen = commands.add_parser("screen", parents=[outputOptions, httpOptions], help="pass matrix and metrics of all companies")
+    screen.add_argument("--min-criteria", type=int, help="only companies passing at least this many criteria")
+    screen.add_argument("--update-prices", action="store_true", help="download the latest prices first")
+    screen.add_argument("--threshold", type=threshold_argument, action="append", metavar="NAME=VALUE",
+                        help="replace a default threshold, can be repeated")
+    screen.set_defaults(run=command_screen)
+
+    report = commands.add_parser("report", parents=[outputOptions], help="criterion values of the passing companies")
+    report.add_argument("--min-criteria", type=int, help="companies passing at least this many criteria (default: all)")
+    report.set_defaults(run=command_report)
+
+    sweep = commands.add_parser("sweep", parents=[outputOptions], help="pass counts over grids of thresholds")
+    sweep.add_argument("--grid", type=lambda text: threshold_argument(text, True), action="append", metavar="NAME=V1,V2,...",
+                       help="values of a threshold, can be repeated")
+    sweep.add_argument("--min-criteria", type=int, help="criteria a company has to pass to be selected (default: all)")
+    sweep.add_argument("--processes", type=int, help="spread the span combinations over this many processes")
+    sweep.set_defaults(run=command_sweep)
+
+    watch = commands.add_parser("watch", parents=[httpOptions], help="re-screen when prices change, events as json lines")
+    watch.add_argument("--interval", type=float, default=60, help="seconds between price polls (default: %(default)s)")
+    watch.add_argument("--iterations", type=int, help="number of polls (default: until interrupted)")
+    watch.add_argument("--threshold", type=threshold_argument, action="append", metavar="NAME=VALUE",
+                       help="replace a default threshold, can be repeated")
+    watch.add_argument("--output", "-o", help="append the events to this file instead of stdout")
+    watch.set_defaults(run=command_watch)
+
+    backtest = commands.add_parser("backtest", parents=[outputOptions], help="run the screen as of each past year")
+    backtest.add_argument("--years", type=int, nargs="+", help="as-of years (default: all years in the data)")
+    backtest.add_argument("--horizon", type=int, default=1, help="years held after each screen (default: %(default)s)")
+    backtest.add_argument("--min-criteria", type=int, help="criteria a company has to pass (default: all)")
+    backtest.add_argument("--selections", action="store_true", help="output the selected companies instead of the summary")
+    backtest.add_argument("--threshold", type=threshold_argument, action="append", metavar="NAME=VALUE",
+                          help="replace a default threshold, can be repeated")
+    backtest.set_defaults(run=command_backtest)
+
+    bench = commands.add_parser("bench", parents=[outputOptions, httpOptions], help="run a benchmark")
+    bench.add_argument("benchmark", choices=["startup", "filters", "tables"])
+    bench.add_argument("--fixtures", default="fixtures", help="directory of saved html pages for the tables benchmark")
+    bench.add_argument("--save-fixtures", nargs="+", metavar="ID", help="download the pages of these companies into --fixtures first")
+    bench.add_argument("--repeat", type=int, default=3)
+    bench.set_defaults(run=command_bench)
+    return parser
+
+# Apply the http options of the downloading commands
+def configure_http(args):
+    global httpCache
+    if args.no_cache:
+        httpCache = None
+    elif args.revalidate:
+        httpCache.ttls = []
+    if httpCache is not None and args.cache_max_mb is not None:
+        httpCache.max_bytes = int(args.cache_max_mb * 1024 * 1024)
+    if args.max_per_host is not None:
+        httpClient.max_per_host = args.max_per_host
+
+# ________________________________________________________
+### START OF RUNTIME:
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    configure_http(args)
+    # Runtime variables are loaded from the shelve file omxHelVariable when first needed
+    state = RuntimeState(args.state)
+    try:
+        if args.command is None:
+            interactive(state)
+            return 0
+        args.stdout = sys.stdout    # for commands that stream their output
+        with contextlib.redirect_stdout(sys.stderr):
+            status, frame = args.run(state, args)
+        if frame is not None:
+            write_output(frame, args.output_format, args.output)
+        return status
+    finally:
+        state.close()
+
+# The interactive prompts
+def interactive(state):
+
+    #pprint.pprint(compDict)
+
+    #currentID = "1901"
+    #create_df_pickles_from_Idlist([currentID])
+    #print(load_company_data_pickle(currentID))
+    #print(get_pe_eps_data(currentID))
+    #print(filter_moderate_Price_to_Assets_ratio(load_company_data_pickle(currentID)))
+
+
+
+    # PROTOCAL: Update data from website
+    if input("Update stale or incomplete df:s from Kauppalehti? (y/n)") == "y":
+        needing, report = incremental_refresh(state.compDict.values())
+        print_refresh_report(report)
+        print(str(len(needing)) + " of " + str(len(state.compDict)) + " companies refreshed")
+        state.errorsList = merge_flagged_companies(state.errorsList, report)
+
+    if input("Update all df:s from Kauppalehti? (y/n)") == "y":
+        report = run_ingest_pipeline(state.compDict.values())
+        print_refresh_report(report)
+        print("Http cache: " + str(httpCache.stats()))
+        print("Http client: " + str(httpClient.stats()))
+        state.errorsList = merge_flagged_companies(state.errorsList, report)
+
+    if input("Import all pickles to the panel store? (y/n)") == "y":
+        panel = import_pickles_to_panel(state.workingIdList)
+        print("Panel store: " + str(panel.index.get_level_values("Company ID").nunique()) + " companies, saved to: " + panelLocation)
+
+    if input("Update the company list from Kauppalehti? (y/n)") == "y":
+        state.compDict = company_dictionary()
+        print(str(len(state.compDict)) + " companies")
+
+    if input("Match company names to tickers? (y/n)") == "y":
+        state.compTickers = get_company_tickers()
+        state.compTickersDict, state.unmatchedTickers = TickerMatcher(state.compTickers).match_all(state.compDict.keys())
+        print("Unmatched company names:")
+        pprint.pprint(state.unmatchedTickers)
+
+    if input("Update prices? (y/n)") == "y":
+        state.priceDict = get_price_dictionary(state.compTickersDict)
+
+    if input("Update share counts? (y/n)") == "y":
+        shares = refresh_share_counts(state.workingIdList)
+        print("Share counts for " + str(sum(isinstance(qty, int) for qty in shares.values())) + " of " + str(len(shares)) + " companies")
+
+    # Check for errors::::::::::::::::::::::::::::
+    if input("Refresh errorsList? (y/n)") == "y":
+        IdList = state.compDict.values()
+        # Refresh the missingDfList
+        missingDfList = list_missing_df(state.compDict)
+        print("MissingDfList:")
+        pprint.pprint(missingDfList)
+        # Refresh errorsList (effectively checks if df is convertible to numeric or not)
+        checkList = []
+        for compId in IdList:
+            if compId not in missingDfList:
+                checkList.append(compId)
+        state.errorsList = create_errorList2(checkList)
+        print("ErrorsList:")
+        print(state.errorsList)
+
+    if input("Create a list of df:s that are missing columns? (y/n)") == "y":
+        dfsWithMissingColumns = list_missing_columns(state.workingIdList)
+        print("These df:s are missing some columns:")
+        pprint.pprint(dfsWithMissingColumns)
+
+        if input("Update df:s for these companies from Kauppalehti? (y/n)") == "y":
+            print_refresh_report(refresh_company_pickles(dfsWithMissingColumns))
+
+    if input("Set errorList to all except those which do not have df:s? (y/n)") == "y":
+        IdList = state.compDict.values()
+        # Refresh the missingDfList
+        missingDfList = list_missing_df(state.compDict)
+        print("MissingDfList:")
+        pprint.pprint(missingDfList)
+        # Refresh errorsList (effectively checks if df is convertible to numeric or not)
+        checkList = []
+        for compId in IdList:
+            if compId not in missingDfList:
+                checkList.append(compId)
+        state.errorsList = checkList
+        print("ErrorsList:")
+        print(state.errorsList)
+
+    if input("Clean all df:s in one pass? (y/n)") == "y":
+        changes = clean_company_pickles(state.compDict.values())
+        print(changes.to_string())
+
+    # Check and repair df:s on the errors list
+    if input("Enter error checking for items on errorsList? (y/n)") == "y":
+        for currentId in state.errorsList:
+            print(get_company_name(currentId))
+            print(currentId)
+            print(load_company_data_pickle(currentId))
+
+            if input("Do you want reload df from website? (y/n)") == "y":
+                # Reload df from website
+                create_df_pickles_from_Idlist([currentId])
+                print(load_company_data_pickle(currentId))
+
+            if input("Do you want to convert columns to num with coerce? (y/n)") == "y":
+                # Convert one column to num with coerce
+                df = convert_error_to_NaN_coerce(currentId)
+                print(df)
+                save_df_to_pickle(currentId, df)
+
+            if input("Do you want to convert - to empty? (y/n)") == "y":
+                # Convert "-" to ""
+                save_df_to_pickle(currentId, convert_line_to_empty(currentId))
+                print(load_company_data_pickle(currentId))
+
+            if input("Do you want convert pickles to numeric and fix unicode? (y/n)") == "y":
+                # convert pickles to numeric and fix unicode
+                df = convert_pickled_df_to_numeric(currentId)
+                print(df)
+                save_df_to_pickle(currentId, df)
+
+        # Keep the panel store in line with the repaired pickles
+        repairedFrames = {}
+        for currentId in state.errorsList:
+            repairedFrames[currentId] = load_company_data_pickle(currentId)
+        upsert_panel(repairedFrames)
+
+
+    # PROTOCAL: Do the stock screening
+
+    if input("Enter stock screening? (y/n)") == "y":
+        # Screen all companies at once from the panel store
+        matrix, metrics, session = screen_companies(state)
+        fCombined = matrix.all_of()     # List of companies passing All Filters
+
+        print(":::::::::::::::::::::::::::::::::::::::::")
+        print("All Filters Combined: ")
+        for criterion, qty in matrix.counts().items():
+            print(criterion + " qty: " + str(qty))
+        print("All filters combined qty: " + str(len(fCombined)))
+        pprint.pprint(fCombined)
+        print("Passing all but one filter: ")
+        pprint.pprint([comp for comp in matrix.at_least(len(matrix.criteria) - 1) if comp not in fCombined])
+
+        # Print the data frames and the metrics of the screening run for the companies that pass all filters
+        for comp in fCombined:
+            df = session.load(state.compDict[comp])
+            values = metrics.loc[[comp]].to_dict("records")[0]
+            print(comp)
+            print(df)
+            print("Company size:")
+            print(values["Turnover"])
+            print("Financial condition: (current ratio (2) / net current assets (0))")
+            print((values["Current Ratio"], values["Net Current Assets"]))
+            print("Earning stability: (years (10) / lowest value)")
+            print((values["Stability Years"], values["Lowest EPS"]))
+            print("Dividend record: (years (20) / lowest value)")
+            print((values["Dividend Years"], values["Lowest Dividend"]))
+            print("Earnings growth: (years (10) / growth (0.33))")
+            print((values["Growth Years"], values["Earnings Growth"]))
+            print("P/E ratio: (years (3) / P/E (15))")
+            print((3, values["P/E (3 year EPS)"]))
+            print("Price to assets: (P/B (1.5) / P/E x P/B (22.5))")
+            print((values["P/B"], values["P/E x P/B"]))
+            print("Graham number / dividend yield / price to NCAV:")
+            print((values["Graham Number"], values["Dividend Yield"], values["Price to NCAV"]))
+
+        print("Session cache: " + str(session.stats()))
+
+if __name__ == "__main__":
+    sys.modules.setdefault("omxHelAnalysis", sys.modules[__name__])    # omxHelBenchmarks imports this module by name
+    sys.exit(main())
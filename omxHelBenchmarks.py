@@ -0,0 +1,156 @@
+#! /usr/bin/env python3
+
+# Purpose: Benchmarks of omxHelAnalysis, run with: python omxHelAnalysis.py bench startup|filters|tables
+# Kept apart from the screener so that the baselines of the benchmarks (the old filter code path) stay out of it
+
+import os, sys, time, subprocess, tracemalloc
+
+import numpy as np
+
+import omxHelAnalysis as omx
+
+# The criteria as they were evaluated before normalize_company_frame, kept as the baseline of benchmark_filter_allocations
+# Each criterion gets its own copy of df and sorts and dropna's it in place
+def legacy_evaluate_criteria(df, price=None):
+    if price is None:
+        price = np.nan
+    results = {}
+    sizeDf = df.copy()
+    sizeDf.sort_index(ascending=False, inplace=True)
+    results["Adequate Size"] = sizeDf.iloc[1]["Turnover"] > 100
+    stabilityDf = df.copy()
+    stabilityDf.sort_index(ascending=False, inplace=True)
+    eps = stabilityDf["Earnings per Share"]
+    eps.dropna(how="any", inplace=True)
+    eps.sort_index(ascending=False, inplace=True)
+    results["Earnings Stability"] = min([99999] + list(eps.iloc[:min(len(eps.index), 10)])) > 0
+    dividendDf = df.copy()
+    dividendDf.sort_index(ascending=False, inplace=True)
+    dividends = dividendDf["Adj. Dividend"].iloc[:min(len(dividendDf.index), 20)]
+    dividends.dropna(how="any", inplace=True)
+    results["Dividend Record"] = 0 not in list(dividends)
+    growthDf = df.copy()
+    growthDf.sort_index(ascending=False, inplace=True)
+    eps = growthDf["Earnings per Share"]
+    eps.dropna(how="any", inplace=True)
+    years = min(len(eps.index), 10)
+    lately = early = np.nan
+    if years > 6:
+        lately, early = eps.iloc[:3].sum() / 3, eps.iloc[len(eps.index)-3:].sum() / 3
+    elif 4 < years < 6:
+        lately, early = eps.iloc[:2].sum() / 2, eps.iloc[3:5].sum() / 2
+    growth = lately / early - 1 if early > 0 else -1
+    results["Earnings Growth"] = growth >= 1/3 and early >= 0 and lately >= 0
+    peDf = df.copy()
+    peDf.sort_index(ascending=False, inplace=True)
+    eps = peDf["Earnings per Share"]
+    eps.dropna(how="any", inplace=True)
+    if len(eps.index) >= 3:
+        average = eps.iloc[:3].sum() / 3
+        pe = 0 if average == 0 else price / average
+        results["Moderate P/E Ratio"] = 0 < pe < 15
+    else:
+        results["Moderate P/E Ratio"] = False
+    assetsDf = df.copy()
+    assetsDf.sort_index(ascending=False, inplace=True)
+    assetsDf.dropna(how="any", inplace=True)
+    assetsDf = assetsDf[["P/B", "P/E"]]
+    results["Moderate Price to Assets"] = len(assetsDf) > 0 and not assetsDf["P/B"].iloc[0] > 1.5 \
+        and not assetsDf["P/E"].iloc[0] * assetsDf["P/B"].iloc[0] > 22.5
+    return results
+
+# Peak bytes allocated and time per company when evaluating all criteria
+# before: legacy_evaluate_criteria on a copy of the df as loaded from the pickle (the earlier session behaviour)
+# after: evaluate_criteria on the normalized read-only df that the screening session caches
+def benchmark_filter_allocations(frames, prices=None):
+    if prices is None:
+        prices = {}
+    normalized = {}
+    for compId, df in frames.items():
+        normalized[compId] = omx.normalize_company_frame(df)
+    results = {}
+    for label, dfs, evaluate in [("before", frames, lambda df, price: legacy_evaluate_criteria(df.copy(), price)),
+                                 ("after", normalized, omx.evaluate_criteria)]:
+        peaks = []
+        start = time.perf_counter()
+        tracemalloc.start()
+        for compId, df in dfs.items():
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            try:
+                evaluate(df, prices.get(compId, np.nan))
+            except (KeyError, IndexError):  # the legacy filters fail on missing columns and short histories
+                pass
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+        results[label] = {"peak bytes per company": float(np.mean(peaks)),
+                          "seconds per company": (time.perf_counter() - start) / max(len(dfs), 1)}
+    return results
+
+# Save the results and dividend pages of the companies as html fixtures for benchmark_table_extraction
+# Returns the results page files, the dividend page of each is saved next to it
+def save_html_fixtures(listOfIds, directory="fixtures"):
+    os.makedirs(directory, exist_ok=True)
+    htmlFiles = []
+    for compId in listOfIds:
+        htmlFile = os.path.join(directory, "tulostiedot_" + str(compId) + ".html")
+        with open(htmlFile, "w", encoding="utf-8") as f:
+            f.write(omx.fetch_page(omx.resultsUrl + compId))
+        with open(dividends_fixture(htmlFile), "w", encoding="utf-8") as f:
+            f.write(omx.fetch_page(omx.dividendsUrl + compId))
+        htmlFiles.append(htmlFile)
+    return htmlFiles
+
+def dividends_fixture(htmlFile):
+    directory, name = os.path.split(htmlFile)
+    return os.path.join(directory, name.replace("tulostiedot_", "osinkohistoria_"))
+
+# Parse time per results page with pd.read_html against parse_tables on saved html fixtures
+# Also checks that the extractors give the same data frames from both, the dividend pages included when saved
+def benchmark_table_extraction(htmlFiles, repeat=5):
+    results = {"read_html seconds per page": [], "parse_tables seconds per page": [], "different results": []}
+    for htmlFile in htmlFiles:
+        with open(htmlFile, encoding="utf-8") as f:
+            html = f.read()
+        start = time.perf_counter()
+        for i in range(repeat):
+            fullPage = omx.parse_page(html)
+        results["read_html seconds per page"].append((time.perf_counter() - start) / repeat)
+        start = time.perf_counter()
+        for i in range(repeat):
+            targetedPage = omx.parse_page(html, omx.resultsTables)
+        results["parse_tables seconds per page"].append((time.perf_counter() - start) / repeat)
+        for extractor in [omx.get_turnover_assets_data, omx.get_pe_eps_data, omx.get_current_ratio]:
+            if not same_extraction(extractor, fullPage, targetedPage):
+                results["different results"].append(htmlFile + ": " + extractor.__name__)
+        if os.path.exists(dividends_fixture(htmlFile)):
+            with open(dividends_fixture(htmlFile), encoding="utf-8") as f:
+                dividendsHtml = f.read()
+            if not same_extraction(omx.get_dividend_data, omx.parse_page(dividendsHtml), omx.parse_page(dividendsHtml, omx.dividendsTables)):
+                results["different results"].append(dividends_fixture(htmlFile) + ": get_dividend_data")
+    for key in ["read_html seconds per page", "parse_tables seconds per page"]:
+        results[key] = float(np.mean(results[key]))
+    return results
+
+# Whether an extractor gives the same df from both parses of a page, a value only one of them can convert is a difference
+# Both are compared as float64 like combine_datasets saves them, parse_tables gives int64 where read_html gives float64
+def same_extraction(extractor, fullPage, targetedPage):
+    try:
+        return extractor(None, fullPage).astype("float64").equals(extractor(None, targetedPage).astype("float64"))
+    except ValueError:
+        return False
+
+# Time to import omxHelAnalysis and to the first screening result from the panel store, in a fresh interpreter
+def benchmark_startup(repeat=3):
+    code = ("import time; start = time.perf_counter(); import omxHelAnalysis as omx; imported = time.perf_counter(); "
+            "omx.screen_panel(omx.load_panel()); print(imported - start, time.perf_counter() - start)")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.abspath(__file__)) + os.pathsep + env.get("PYTHONPATH", "")
+    importTimes = []
+    resultTimes = []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True).stdout
+        importTime, resultTime = output.split()
+        importTimes.append(float(importTime))
+        resultTimes.append(float(resultTime))
+    return {"import seconds": float(np.median(importTimes)), "first result seconds": float(np.median(resultTimes))}
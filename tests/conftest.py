@@ -0,0 +1,23 @@
+import os, sys
+
+import pytest
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository)
+
+import omxHelAnalysis as omx
+
+fixturesDirectory = os.path.join(repository, "fixtures")
+
+def read_fixture(name):
+    with open(os.path.join(fixturesDirectory, name), encoding="utf-8") as f:
+        return f.read()
+
+# Every test runs in its own directory, the screener keeps its pickles, indexes and http cache in the working directory
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(omx, "httpCache", omx.HttpCache())
+    monkeypatch.setattr(omx, "quoteCache", {})
+    yield tmp_path
+    omx.httpCache.close()
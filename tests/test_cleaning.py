@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+import omxHelAnalysis as omx
+
+def frame(data, years):
+    return pd.DataFrame(data, index=pd.Index(years, name="Year"))
+
+def test_clean_frames_converts_cells():
+    frames = {"1": frame({"Turnover": ["1\xa0234", "-", "12.5"], "P/E": [10.0, np.nan, "n/a"]}, [2016, 2015, 2014])}
+    cleaned, changes = omx.clean_frames(frames)
+    df = cleaned["1"]
+    assert list(df.columns) == ["Turnover", "P/E"]
+    assert all(df.dtypes == "float64")
+    assert df.loc[2016, "Turnover"] == 1234 and np.isnan(df.loc[2015, "Turnover"]) and df.loc[2014, "Turnover"] == 12.5
+    assert df.loc[2016, "P/E"] == 10 and np.isnan(df.loc[2014, "P/E"])
+    assert dict(zip(zip(changes["Year"], changes["Column"]), changes["Change"])) == {
+        (2016, "Turnover"): "thousand separator", (2015, "Turnover"): "dash to NaN",
+        (2014, "Turnover"): "text to number", (2014, "P/E"): "not a number to NaN"}
+
+def test_clean_frames_sums_dividends_of_duplicated_years():
+    frames = {"1": frame({"Adj. Dividend": ["0.5", "0.25", "0.7"], "P/B": [1.0, 1.0, 2.0]}, [2015, 2015, 2014]),
+              "2": frame({"Adj. Dividend": [0.1], "P/B": [1.5]}, [2015])}
+    cleaned, changes = omx.clean_frames(frames)
+    assert list(cleaned["1"].index) == [2015, 2014]
+    assert cleaned["1"].loc[2015, "Adj. Dividend"] == 0.75 and cleaned["1"].loc[2015, "P/B"] == 1.0
+    assert cleaned["2"].loc[2015, "Adj. Dividend"] == 0.1
+    assert (changes["Change"] == "duplicate year summed").sum() == 1
+
+def test_clean_frames_keeps_clean_frames_unchanged():
+    df = frame({"Turnover": [1.0, 2.0], "P/E": [np.nan, 3.0]}, [2016, 2015])
+    cleaned, changes = omx.clean_frames({"1": df})
+    pd.testing.assert_frame_equal(cleaned["1"], df)
+    assert len(changes) == 0
+    assert omx.clean_frames({})[0] == {}
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+import requests
+
+import omxHelAnalysis as omx
+
+def response(status, body, contentType="text/html", etag=None):
+    res = requests.Response()
+    res.status_code = status
+    res._content = body
+    res.headers["Content-Type"] = contentType
+    if etag:
+        res.headers["ETag"] = etag
+    res.encoding = requests.utils.get_encoding_from_headers(res.headers)
+    return res
+
+def test_page_encoding_reads_the_meta_charset():
+    body = '<html><head><meta charset="utf-8"></head><body>1\xa0234</body></html>'.encode("utf-8")
+    assert omx.page_encoding("text/html", body) == "utf-8"
+    assert omx.page_encoding("text/html; charset=ISO-8859-1", body) == "ISO-8859-1"
+    assert omx.page_encoding("text/html", b"<html></html>") is None
+
+def test_fetch_page_decodes_utf8_without_a_charset_header(monkeypatch):
+    body = '<html><head><meta charset="utf-8"></head><body>1\xa0234</body></html>'.encode("utf-8")
+    monkeypatch.setattr(omx, "download", lambda url, headers=None, per_host_rate=None: response(200, body))
+    assert "1\xa0234" in omx.fetch_page("http://example.com/tulostiedot.jsp?klid=1")
+    assert "1\xa0234" in omx.fetch_page("http://example.com/tulostiedot.jsp?klid=1")    # from the cache
+
+def test_cache_evicts_the_least_recently_used():
+    cache = omx.HttpCache("cache", max_bytes=250, ttls=[("", 3600)])
+    download = lambda url, headers: response(200, b"x" * 100)
+    for url in ["a", "b", "c"]:
+        cache.fetch(url, download)
+        if url == "b":
+            cache.fetch("a", download)  # a is used again, b becomes the least recently used
+    assert list(cache.usage) == ["a", "c"]
+    assert cache.stats()["bytes"] == 200 and cache.stats()["evictions"] == 1
+    cache.close()
+    cache.open()
+    assert list(cache.usage) == ["a", "c"] and cache.total == 200
+    cache.close()
+
+def test_cache_downloads_again_when_a_revalidated_body_is_gone():
+    cache = omx.HttpCache("cache", ttls=[])
+    calls = []
+
+    def download(url, headers):
+        calls.append(dict(headers))
+        return response(304, b"") if headers else response(200, b"page", etag='"1"')
+
+    cache.fetch("a", download)
+    os.remove(os.path.join("cache", cache.index["a"]["file"]))
+    assert cache.fetch("a", download)[0] == b"page"
+    assert calls == [{}, {"If-None-Match": '"1"'}, {}]
+    cache.close()
+
+@pytest.mark.parametrize("text, shares", [("12 345 678", 12345678), ("12\xa0345\xa0678 kpl", 12345678), ("1,2 milj.", 1200000),
+                                          ("1,2 milj. kpl", 1200000), ("3,25 mrd", 3250000000), ("1,5", None), ("1,2 foo", None)])
+def test_parse_share_value(text, shares):
+    assert omx.parse_share_value(text) == shares
+
+def test_last_prices_with_a_repeated_symbol(monkeypatch):
+    quotes = '{"quoteResponse": {"result": [{"symbol": "ABC.HE", "regularMarketPrice": 1.5}, {"symbol": "ABC.HE", "regularMarketPrice": 1.6}]}}'
+    monkeypatch.setattr(omx, "fetch_page", lambda url, max_age=None: quotes)
+    assert omx.get_last_prices(["ABC"])["ABC"] == 1.5
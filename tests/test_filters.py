@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+import omxHelAnalysis as omx
+
+# Random company dfs with missing values, missing columns and histories from 1 to 21 years
+def random_frames(count, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = {}
+    prices = {}
+    for i in range(count):
+        n = int(rng.integers(1, 22))
+        df = pd.DataFrame({
+            "Turnover": rng.uniform(0, 300, n),
+            "Adj. Net Current Assets": rng.normal(10, 50, n),
+            "P/B": rng.uniform(0, 3, n),
+            "P/E": rng.uniform(-5, 30, n),
+            "Earnings per Share": rng.normal(1, 2, n),
+            "Current Ratio": rng.uniform(0, 4, n),
+            "Adj. Dividend": rng.choice([0, 0.5, 1.0], n)}, index=pd.Index(np.arange(2016 - n + 1, 2017), name="Year"))
+        df = df.mask(rng.random(df.shape) < 0.1)
+        if rng.random() < 0.1:
+            df = df.drop(columns=[rng.choice(omx.panelColumns)])
+        compId = str(1000 + i)
+        frames[compId] = df
+        prices[compId] = float(rng.uniform(1, 40)) if rng.random() < 0.9 else np.nan
+    return frames, prices
+
+def test_panel_verdicts_match_evaluate_criteria():
+    frames, prices = random_frames(300)
+    panel = omx.build_panel(frames)
+    passMatrix, metrics = omx.screen_panel(panel, prices)
+    for compId in frames.keys():
+        results = omx.evaluate_criteria(omx.get_company_frame(panel, compId), prices[compId])
+        for criterion, result in results.items():
+            assert bool(result.passed) == bool(passMatrix.loc[compId, criterion]), (compId, criterion)
+
+def test_panel_verdicts_match_evaluate_criteria_with_thresholds():
+    frames, prices = random_frames(100, seed=1)
+    panel = omx.build_panel(frames)
+    passMatrix, metrics = omx.screen_panel(panel, prices, {"PElimit": 10, "turnoverLimit": 150})
+    strict = omx.screen_panel(panel, prices)[0]
+    assert (passMatrix["Moderate P/E Ratio"] <= strict["Moderate P/E Ratio"]).all()
+    assert (passMatrix["Adequate Size"] <= strict["Adequate Size"]).all()
+    assert passMatrix["Earnings Stability"].equals(strict["Earnings Stability"])
+
+def test_evaluate_criteria_does_not_change_the_df():
+    frames, prices = random_frames(20, seed=2)
+    for compId, df in frames.items():
+        before = df.copy()
+        omx.evaluate_criteria(df, prices[compId])
+        pd.testing.assert_frame_equal(df, before)
+
+def test_backtest_without_years_is_empty():
+    summary, selections = omx.backtest(omx.empty_panel())
+    assert len(summary) == 0 and len(selections) == 0
+    frames, prices = random_frames(1, seed=3)
+    summary, selections = omx.backtest(omx.build_panel({"1": frames["1000"].iloc[[-1]]}))
+    assert len(summary) == 0
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+import requests
+
+import omxHelAnalysis as omx
+from conftest import read_fixture
+
+# Stands in for HttpClient: answers from pages {url: [(status, body)]}, the last answer of a url repeats
+class FakeHttpClient:
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def get(self, url, headers=None, per_host_rate=None):
+        self.calls.append(url)
+        answers = self.pages.get(url, [(404, b"")])
+        status, body = answers[min(self.calls.count(url), len(answers)) - 1]
+        res = requests.Response()
+        res.url = url
+        res.status_code = status
+        res._content = body
+        res.headers["Content-Type"] = "text/html"   # no charset, the pages have a <meta> charset
+        res.encoding = requests.utils.get_encoding_from_headers(res.headers)
+        return res
+
+def company_pages(compId, fixtureId):
+    return {omx.resultsUrl + compId: [(200, read_fixture("tulostiedot_" + fixtureId + ".html").encode("utf-8"))],
+            omx.dividendsUrl + compId: [(200, read_fixture("osinkohistoria_" + fixtureId + ".html").encode("utf-8"))]}
+
+@pytest.fixture
+def client(monkeypatch):
+    pages = {}
+    pages.update(company_pages("1001", "1001"))
+    pages.update(company_pages("1002", "1002"))
+    pages[omx.stockUrl + "1001"] = [(200, "<table><tr><td>Osakemäärä</td><td>1,2 milj. kpl</td></tr></table>".encode("utf-8"))]
+    fake = FakeHttpClient(pages)
+    monkeypatch.setattr(omx, "httpClient", fake)
+    return fake
+
+def run(listOfIds, **options):
+    options = dict({"parse_workers": 1, "backoff": 0, "share_counts": False, "update_panel": False}, **options)
+    return omx.run_ingest_pipeline(listOfIds, **options)
+
+def test_pipeline_saves_and_validates(client):
+    report = run(["1001", "1002"])
+    assert all(report[compId]["ok"] and not report[compId].get("unchanged") for compId in report)
+    assert report["1001"]["problems"] == []
+    df = omx.load_company_data_pickle("1001")
+    assert df.loc[2016, "Turnover"] == 1234.5
+    index = omx.read_company_index()
+    assert index["1001"]["fingerprint"] and index["1001"]["latestYear"] == 2016
+
+def test_pipeline_skips_unchanged_pages(client):
+    run(["1001", "1002"])
+    modified = os.path.getmtime(".\\omxHelAnalysis\\1001.pickle")
+    report = run(["1001", "1002"])
+    assert report["1001"]["unchanged"] and report["1002"]["unchanged"]
+    assert os.path.getmtime(".\\omxHelAnalysis\\1001.pickle") == modified
+    assert not run(["1001"], skip_unchanged=False)["1001"].get("unchanged")
+
+def test_pipeline_reparses_flagged_companies(client):
+    run(["1001"])
+    report = run(["1001"], reparse=["1001"])
+    assert report["1001"]["ok"] and not report["1001"].get("unchanged")
+
+def test_pipeline_does_not_retry_404(client):
+    client.pages[omx.resultsUrl + "1003"] = [(404, b"")]
+    report = run(["1003"])
+    assert not report["1003"]["ok"]
+    assert client.calls.count(omx.resultsUrl + "1003") == 1
+
+def test_pipeline_retries_server_errors(client):
+    client.pages.update(company_pages("1004", "1001"))
+    client.pages[omx.resultsUrl + "1004"].insert(0, (503, b""))
+    report = run(["1004"])
+    assert report["1004"]["ok"] and report["1004"]["attempts"] == 2
+
+def test_pipeline_records_share_counts(client):
+    run(["1001"], share_counts=True)
+    assert omx.read_share_counts(["1001", "1002"]) == {"1001": 1200000}
+
+def test_errors_list_keeps_unchanged_companies(client):
+    run(["1001", "1002"])
+    report = run(["1001", "1002"], reparse=["1002"])
+    assert omx.merge_flagged_companies(["1001", "1002"], report) == ["1001"]
+
+def test_refreshed_companies_have_a_fetch_record(client):
+    report = omx.refresh_company_pickles(["1001"], backoff=0, update_panel=False)
+    assert report["1001"]["ok"]
+    assert "1001" not in omx.companies_needing_refresh(["1001"])
@@ -0,0 +1,66 @@
+import glob, io, os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import omxHelAnalysis as omx
+import omxHelBenchmarks as benchmarks
+from conftest import fixturesDirectory, read_fixture
+
+fixturePages = sorted(os.path.basename(path) for path in glob.glob(os.path.join(fixturesDirectory, "*.html")))
+
+edgeCases = """<html><head><meta charset="utf-8"></head><body>
+<table><tr><td>Liikevaihto</td><td>1\xa0234.5</td><td>-</td></tr>
+<tr><td rowspan="2">Tase</td><td colspan="2">yhteensä</td></tr>
+<tr><td>12.0</td><td>n/a</td></tr>
+<tr style="display: none"><td>piilotettu</td><td>1</td><td>2</td></tr>
+<tr><td>Rivin<br>vaihto</td><td></td></tr>
+<tfoot><tr><td>Alaviite</td><td>3</td><td>4</td></tr></tfoot></table>
+<table><tr><td>\xa0</td></tr></table>
+<table><thead><tr><th>Vuosi</th><th>Osinko</th></tr></thead><tbody><tr><td>2016</td><td>-</td></tr></tbody></table>
+</body></html>"""
+
+# A cell as pd.read_html and parse_tables can both give it: None for missing, a float for numbers, otherwise the text
+def cell(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+def assert_same_tables(html):
+    expected = pd.read_html(io.StringIO(html))
+    parsed = omx.parse_tables(html, range(len(expected)))
+    assert len(omx.find_tables(omx.lxml.html.fromstring(html))) == len(expected)
+    for index, table in enumerate(expected):
+        assert parsed[index].shape == table.shape, index
+        assert [[cell(value) for value in row] for row in parsed[index].itertuples(index=False)] == \
+               [[cell(value) for value in row] for row in table.itertuples(index=False)], index
+
+@pytest.mark.parametrize("name", fixturePages)
+def test_parse_tables_matches_read_html_on_fixtures(name):
+    assert_same_tables(read_fixture(name))
+
+def test_parse_tables_matches_read_html_on_edge_cases():
+    assert_same_tables(edgeCases)
+
+def test_parse_tables_spans_and_cells():
+    table = omx.parse_tables(edgeCases, [0])[0]
+    assert list(table.iloc[0]) == ["Liikevaihto", "1\xa0234.5", "-"]
+    assert list(table.iloc[1]) == ["Tase", "yhteensä", "yhteensä"]
+    assert table.iloc[2, 0] == "Tase" and table.iloc[2, 1] == "12.0" and pd.isna(table.iloc[2, 2])
+    assert table.iloc[3, 0] == "Rivin vaihto"
+    assert list(table.iloc[4]) == ["Alaviite", "3", "4"]
+
+def test_extractors_give_the_same_data_from_both_parsers():
+    results = benchmarks.benchmark_table_extraction(sorted(glob.glob(os.path.join(fixturesDirectory, "tulostiedot_*.html"))), repeat=1)
+    assert results["different results"] == []
+
+def test_company_df_from_fixture_pages():
+    df = omx.parse_company_pages("1001", read_fixture("tulostiedot_1001.html"), read_fixture("osinkohistoria_1001.html"))
+    assert omx.validate_company_df(df) == []
+    assert df.loc[2016, "Turnover"] == 1234.5
+    assert df.loc[2014, "Adj. Net Current Assets"] == -15.2
+    assert df.loc[2015, "Adj. Dividend"] == 0.75     # two dividends in 2015 are summed